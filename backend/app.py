@@ -3,6 +3,9 @@
 # ==========================
 from flask import Flask, request, redirect, session, jsonify
 import sqlglot
+from sqlglot import exp
+from sqlglot.dialects.dialect import Dialect
+from sqlglot.tokens import TokenType
 import time
 import json
 import os
@@ -11,6 +14,21 @@ import csv
 from io import StringIO
 import datetime
 import shutil
+import operator
+import struct
+import sys
+from array import array
+from itertools import repeat, product, islice
+from functools import cmp_to_key
+import heapq
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right
+import threading
+import zlib
+import hashlib
+import uuid
+import atexit
+from contextlib import contextmanager, suppress
 from flask_cors import CORS
 import unicodedata
 from google_auth_oauthlib.flow import Flow
@@ -23,7 +41,7 @@ from google.auth.transport import requests as grequests
 # CONSTANTES Y APP FLASK
 # ==========================
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag"])
 DATA_DIR = "data"
 app.secret_key = "una_clave_secreta_segura"
 
@@ -31,31 +49,1498 @@ os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
 
 CLIENT_SECRETS_FILE = "credentials.json"
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+# ==========================
+# ALMACENAMIENTO COLUMNAR BINARIO
+# ==========================
+# Cada tabla vive en data/<db>/<tabla>.tbl con este formato:
+#   MAGIC (4 bytes) | versión (1 byte) | largo del header (uint32 LE) | header JSON | bloques
+# El header guarda el esquema, el número de filas y la descripción de cada
+# bloque. Cada bloque es un arreglo tipado de una columna:
+#   "i" enteros (el ancho más pequeño que alcance), "f" decimales (float64),
+#   "b" booleanos (1 byte), "s" texto UTF-8, "j" JSON por valor.
+# Los textos con muchos repetidos se guardan con diccionario + códigos.
+# Si la columna tiene nulos se antepone un mapa de nulos de 1 byte por fila.
+# Las tablas antiguas en <tabla>.json se migran al leerlas (o con migrate_all_tables).
+TABLE_EXT = ".tbl"
+LEGACY_TABLE_EXT = ".json"
+ROW_LOG_EXT = ".log"
+TABLE_MAGIC = b"FDBC"
+TABLE_FORMAT_VERSION = 1
+
+def table_file(db, table):
+    return os.path.join(DATA_DIR, db, f"{table}{TABLE_EXT}")
+
+def legacy_table_file(db, table):
+    return os.path.join(DATA_DIR, db, f"{table}{LEGACY_TABLE_EXT}")
+
+def row_log_file(db, table):
+    return os.path.join(DATA_DIR, db, f"{table}{ROW_LOG_EXT}")
+
+def table_exists(db, table):
+    return os.path.exists(table_file(db, table)) or os.path.exists(legacy_table_file(db, table))
+
+def list_table_names(db):
+    db_path = os.path.join(DATA_DIR, db)
+    names = []
+    for f in sorted(os.listdir(db_path)):
+        for ext in (TABLE_EXT, LEGACY_TABLE_EXT):
+            if f.endswith(ext) and os.path.isfile(os.path.join(db_path, f)):
+                name = f[:-len(ext)]
+                if name not in names:
+                    names.append(name)
+    return names
+
+def drop_table_files(db, table):
+    pool_invalidate(db, table)
+    catalog_drop_table(db, table)
+    index_paths = [os.path.join(DATA_DIR, db, f) for f in index_file_names(db, table)]
+    for path in [table_file(db, table), legacy_table_file(db, table), row_log_file(db, table)] + index_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def rename_table_files(db, table, new_table):
+    pool_invalidate(db, table)
+    pool_invalidate(db, new_table)
+    for old_path, new_path in ((table_file(db, table), table_file(db, new_table)),
+                               (legacy_table_file(db, table), legacy_table_file(db, new_table)),
+                               (row_log_file(db, table), row_log_file(db, new_table))):
+        if os.path.exists(old_path):
+            os.rename(old_path, new_path)
+    for f in index_file_names(db, table):
+        os.rename(os.path.join(DATA_DIR, db, f), os.path.join(DATA_DIR, db, new_table + f[len(table):]))
+    catalog_rename_table(db, table, new_table)
+
+def _column_kind(values):
+    kinds = set()
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            kinds.add("b")
+        elif isinstance(v, int):
+            kinds.add("i" if -2**63 <= v < 2**63 else "j")
+        elif isinstance(v, float):
+            kinds.add("f")
+        elif isinstance(v, str):
+            kinds.add("s")
+        else:
+            kinds.add("j")
+    if len(kinds) == 1:
+        return kinds.pop()
+    return "j" if kinds else "s"
+
+def _int_typecode(values):
+    lo = min(values, default=0)
+    hi = max(values, default=0)
+    for code, bits in (("b", 8), ("h", 16), ("i", 32)):
+        if -2**(bits - 1) <= lo and hi < 2**(bits - 1) and array(code).itemsize * 8 == bits:
+            return code
+    return "q"
+
+def _encode_texts(texts):
+    """Textos separados por el carácter nulo (un solo split al leer) u offsets si alguno lo contiene."""
+    if not any("\x00" in t for t in texts):
+        return {"sep": True}, "\x00".join(texts).encode("utf-8")
+    offsets = [0]
+    for t in texts:
+        offsets.append(offsets[-1] + len(t))
+    code = "I" if offsets[-1] < 2**32 else "Q"
+    offsets_raw = array(code, offsets).tobytes()
+    return {"sep": False, "offsets": code, "offsets_length": len(offsets_raw)}, offsets_raw + "".join(texts).encode("utf-8")
+
+def _decode_texts(meta, buf, n):
+    if meta["sep"]:
+        if n == 0:
+            return []
+        return bytes(buf).decode("utf-8").split("\x00")
+    offsets = array(meta["offsets"])
+    offsets.frombytes(buf[:meta["offsets_length"]])
+    if meta.get("swap"):
+        offsets.byteswap()
+    text = bytes(buf[meta["offsets_length"]:]).decode("utf-8")
+    return [text[offsets[i]:offsets[i + 1]] for i in range(n)]
+
+def _encode_column(name, values):
+    """Devuelve (metadatos del bloque, bytes del bloque) para una columna."""
+    kind = _column_kind(values)
+    meta = {"name": name, "kind": kind, "nulls": any(v is None for v in values)}
+    parts = []
+    if meta["nulls"]:
+        parts.append(bytes(1 if v is None else 0 for v in values))
+    if kind == "i":
+        ints = [0 if v is None else v for v in values]
+        meta["code"] = _int_typecode(ints)
+        parts.append(array(meta["code"], ints).tobytes())
+    elif kind == "f":
+        parts.append(array("d", (0.0 if v is None else v for v in values)).tobytes())
+    elif kind == "b":
+        parts.append(bytes(1 if v else 0 for v in values))
+    else:
+        if kind == "j":
+            texts = [json.dumps(v) for v in values]
+        else:
+            texts = ["" if v is None else v for v in values]
+        distinct = {}
+        for t in texts:
+            if t not in distinct:
+                distinct[t] = len(distinct)
+                if len(distinct) > 65535:
+                    break
+        if len(distinct) <= 65535 and len(distinct) * 2 <= len(texts):
+            # Codificación por diccionario para columnas con muchos valores repetidos
+            meta["code"] = "B" if len(distinct) <= 256 else "H"
+            codes_raw = array(meta["code"], [distinct[t] for t in texts]).tobytes()
+            text_meta, text_raw = _encode_texts(list(distinct))
+            meta.update({"dictionary": len(distinct), "codes_length": len(codes_raw), "texts": text_meta})
+            parts.append(codes_raw)
+            parts.append(text_raw)
+        else:
+            text_meta, text_raw = _encode_texts(texts)
+            meta["texts"] = text_meta
+            parts.append(text_raw)
+    raw = b"".join(parts)
+    meta["length"] = len(raw)
+    return meta, raw
+
+def _decode_column(meta, buf, n, swap):
+    pos = 0
+    nulls = None
+    if meta["nulls"]:
+        nulls = buf[pos:pos + n]
+        pos += n
+    kind = meta["kind"]
+    if kind in ("i", "f"):
+        arr = array(meta.get("code", "d"))
+        arr.frombytes(buf[pos:pos + arr.itemsize * n])
+        if swap:
+            arr.byteswap()
+        values = arr.tolist()
+    elif kind == "b":
+        values = [b == 1 for b in buf[pos:pos + n]]
+    else:
+        text_meta = dict(meta["texts"], swap=swap)
+        if "dictionary" in meta:
+            codes = array(meta["code"])
+            codes.frombytes(buf[pos:pos + meta["codes_length"]])
+            if swap:
+                codes.byteswap()
+            pos += meta["codes_length"]
+            dictionary = _decode_texts(text_meta, buf[pos:], meta["dictionary"])
+            if kind == "j":
+                dictionary = [json.loads(v) for v in dictionary]
+            values = [dictionary[c] for c in codes]
+        else:
+            values = _decode_texts(text_meta, buf[pos:], n)
+            if kind == "j":
+                values = [json.loads(v) for v in values]
+    if nulls is not None:
+        values = [None if is_null else v for v, is_null in zip(values, nulls)]
+    return values
+
+def encode_table(data):
+    """Serializa {"columns", "rows"} al formato columnar binario."""
+    rows = data.get("rows", [])
+    names = [col["name"] for col in data.get("columns", [])]
+    # Columnas presentes en las filas pero no en el esquema (no debería pasar)
+    for row in rows:
+        for key in row:
+            if key not in names:
+                names.append(key)
+    blocks = []
+    payload = []
+    for name in names:
+        meta, raw = _encode_column(name, [row.get(name) for row in rows])
+        blocks.append(meta)
+        payload.append(raw)
+    header = json.dumps({
+        "columns": data.get("columns", []),
+        "row_count": len(rows),
+        "lsn": data.get("lsn", 0),
+        "typed": data.get("typed", False),
+        "indexes": data.get("indexes", []),
+        "unique": data.get("unique", []),
+        "byteorder": sys.byteorder,
+        "blocks": blocks
+    }).encode("utf-8")
+    return b"".join([TABLE_MAGIC, bytes([TABLE_FORMAT_VERSION]),
+                     struct.pack("<I", len(header)), header] + payload)
+
+def _read_header(f):
+    prefix = f.read(9)
+    if len(prefix) < 9 or prefix[:4] != TABLE_MAGIC:
+        raise ValueError("Archivo de tabla corrupto o con formato desconocido")
+    (header_len,) = struct.unpack("<I", prefix[5:9])
+    return json.loads(f.read(header_len).decode("utf-8"))
+
+def decode_table(raw):
+    """Reconstruye {"columns", "rows"} desde el formato columnar binario."""
+    buf = memoryview(raw)
+    if bytes(buf[:4]) != TABLE_MAGIC:
+        raise ValueError("Archivo de tabla corrupto o con formato desconocido")
+    (header_len,) = struct.unpack_from("<I", buf, 5)
+    header = json.loads(bytes(buf[9:9 + header_len]).decode("utf-8"))
+    n = header["row_count"]
+    swap = header.get("byteorder", sys.byteorder) != sys.byteorder
+    pos = 9 + header_len
+    names = []
+    columns = []
+    for block in header["blocks"]:
+        names.append(block["name"])
+        columns.append(_decode_column(block, buf[pos:pos + block["length"]], n, swap))
+        pos += block["length"]
+    if columns:
+        rows = list(map(dict, map(zip, repeat(names), zip(*columns))))
+    else:
+        rows = [{} for _ in range(n)]
+    return {"columns": header["columns"], "rows": rows, "lsn": header.get("lsn", 0),
+            "typed": header.get("typed", False), "indexes": header.get("indexes", []),
+            "unique": header.get("unique", [])}
+
+def migrate_table(db, table):
+    """Convierte una tabla JSON antigua al formato columnar y borra el .json."""
+    legacy_path = legacy_table_file(db, table)
+    with open(legacy_path, "r") as f:
+        data = json.load(f)
+    save_table(db, table, data)
+    os.remove(legacy_path)
+    return data
+
+def migrate_all_tables():
+    """Migra todas las tablas JSON de todas las bases al formato columnar."""
+    if not os.path.isdir(DATA_DIR):
+        return 0
+    migrated = 0
+    for db in os.listdir(DATA_DIR):
+        db_path = os.path.join(DATA_DIR, db)
+        if not os.path.isdir(db_path):
+            continue
+        for f in os.listdir(db_path):
+            if f.endswith(LEGACY_TABLE_EXT) and not os.path.exists(os.path.join(db_path, f[:-len(LEGACY_TABLE_EXT)] + TABLE_EXT)):
+                migrate_table(db, f[:-len(LEGACY_TABLE_EXT)])
+                migrated += 1
+    return migrated
+
+# ==========================
+# BUFFER POOL DE TABLAS
+# ==========================
+# Guarda en memoria las tablas ya decodificadas, con llave (db, tabla) y
+# desalojo LRU cuando se supera BUFFER_POOL_BYTES. Cada entrada recuerda el
+# mtime y tamaño de sus archivos; si cambian (por ejemplo, alguien editó el
+# archivo por fuera), la entrada se descarta y se vuelve a leer de disco.
+# Las filas cacheadas son compartidas: quien modifique una fila debe
+# reemplazarla por una copia, nunca mutarla en sitio.
+BUFFER_POOL_BYTES = int(os.environ.get("BUFFER_POOL_BYTES", 256 * 1024 * 1024))
+# Estimación de bytes en memoria por cada byte en disco
+BUFFER_POOL_EXPANSION = 8
+
+buffer_pool = OrderedDict()
+buffer_pool_lock = threading.Lock()
+buffer_pool_used = 0
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def table_stamp(db, table):
+    """Firma (mtime, tamaño) de los archivos de la tabla, o None si no existe."""
+    base = _file_stamp(table_file(db, table))
+    if base is None:
+        return None
+    return (base, _file_stamp(row_log_file(db, table)))
+
+def _stamp_bytes(stamp):
+    base, log = stamp
+    return (base[1] + (log[1] if log else 0)) * BUFFER_POOL_EXPANSION
+
+def _table_view(data):
+    # Lista nueva (filas compartidas) para que append/reasignaciones no toquen la caché
+    return {**data, "rows": list(data["rows"])}
+
+def pool_get(db, table, stamp):
+    with buffer_pool_lock:
+        entry = buffer_pool.get((db, table))
+        if entry is None:
+            return None
+        if entry["stamp"] != stamp:
+            _pool_discard((db, table))
+            return None
+        buffer_pool.move_to_end((db, table))
+        return _table_view(entry["data"])
+
+def pool_put(db, table, data, stamp):
+    global buffer_pool_used
+    if stamp is None:
+        return
+    size = _stamp_bytes(stamp)
+    with buffer_pool_lock:
+        _pool_discard((db, table))
+        if size > BUFFER_POOL_BYTES:
+            return
+        buffer_pool[(db, table)] = {"data": _table_view(data), "stamp": stamp, "bytes": size}
+        buffer_pool_used += size
+        while buffer_pool_used > BUFFER_POOL_BYTES:
+            _pool_discard(next(iter(buffer_pool)))
+
+def pool_append(db, table, rows, lsn, old_stamp, new_stamp):
+    """Agrega filas recién insertadas a la entrada cacheada si seguía vigente."""
+    global buffer_pool_used
+    with buffer_pool_lock:
+        entry = buffer_pool.get((db, table))
+        if entry is None:
+            return
+        if entry["stamp"] != old_stamp or new_stamp is None:
+            _pool_discard((db, table))
+            return
+        entry["data"]["rows"].extend(rows)
+        entry["data"]["lsn"] = max(entry["data"]["lsn"], lsn)
+        entry["stamp"] = new_stamp
+        size = _stamp_bytes(new_stamp)
+        buffer_pool_used += size - entry["bytes"]
+        entry["bytes"] = size
+        buffer_pool.move_to_end((db, table))
+        while buffer_pool_used > BUFFER_POOL_BYTES:
+            _pool_discard(next(iter(buffer_pool)))
+
+def pool_invalidate(db, table=None):
+    """Descarta una tabla, o todas las tablas de una base si table es None."""
+    with buffer_pool_lock:
+        for key in [k for k in buffer_pool if k[0] == db and (table is None or k[1] == table)]:
+            _pool_discard(key)
+    index_invalidate(db, table)
+
+def _pool_discard(key):
+    # Se llama con buffer_pool_lock tomado
+    global buffer_pool_used
+    entry = buffer_pool.pop(key, None)
+    if entry is not None:
+        buffer_pool_used -= entry["bytes"]
+
+# ==========================
+# LOG DE INSERCIONES (APPEND-ONLY)
+# ==========================
+# INSERT agrega la fila al final de data/<db>/<tabla>.log en O(1). Cada línea
+# es [lsn, fila] en JSON (las líneas antiguas sin lsn son solo la fila).
+# load_table mezcla el log con el archivo base y, cuando el log supera
+# ROW_LOG_COMPACT_BYTES, se compacta dentro del archivo base.
+ROW_LOG_COMPACT_BYTES = 1024 * 1024
+
+def append_rows(db, table, rows, lsn=0):
+    """Agrega filas al log de la tabla. Devuelve el tamaño del log en bytes."""
+    path = row_log_file(db, table)
+    old_stamp = table_stamp(db, table)
+    with open(path, "ab+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        data = b"".join(json.dumps([lsn, row]).encode("utf-8") + b"\n" for row in rows)
+        # Si una escritura anterior quedó a medias, se empieza en una línea nueva
+        if size:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                data = b"\n" + data
+        f.write(data)
+    wal_mark_dirty(path)
+    pool_append(db, table, rows, lsn, old_stamp, table_stamp(db, table))
+    catalog_rows_appended(db, table, len(rows))
+    return size + len(data)
+
+def read_row_log(db, table):
+    """Devuelve (filas del log, mayor lsn aplicado en el log)."""
+    try:
+        with open(row_log_file(db, table), "rb") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return [], 0
+    rows = []
+    max_lsn = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # Línea truncada por una caída a mitad de escritura
+            continue
+        if isinstance(entry, list):
+            lsn, row = entry
+            max_lsn = max(max_lsn, lsn)
+            rows.append(row)
+        else:
+            rows.append(entry)
+    return rows, max_lsn
+
+def compact_table(db, table):
+    """Pliega el log de inserciones dentro del archivo base de la tabla."""
+    table_data = load_table(db, table)
+    if table_data:
+        save_table(db, table, table_data)
+    return table_data
+
+def maybe_compact_table(db, table, log_size):
+    if log_size >= ROW_LOG_COMPACT_BYTES:
+        compact_table(db, table)
+
+# ==========================
+# ÍNDICES SECUNDARIOS
+# ==========================
+# CREATE INDEX nombre ON db.tabla (col1, col2, ...) guarda la definición en el
+# header de la tabla ("indexes") y, junto al archivo de la tabla,
+# <tabla>.<nombre>.idx con las posiciones de las filas ordenadas por clave.
+# save_table lo reescribe cada vez que reescribe la tabla (UPDATE, DELETE,
+# compactación); los INSERT que van al log de inserciones se agregan en
+# memoria con bisect la próxima vez que se usa el índice.
+#
+# En memoria un índice son dos listas paralelas: claves ordenadas y
+# posiciones de fila. Una igualdad sobre un prefijo de las columnas, con un
+# rango opcional sobre la siguiente, se resuelve con dos búsquedas binarias.
+# Cada valor se ordena como (rango, valor) para poder mezclar NULL, números y
+# texto en la misma lista.
+INDEX_EXT = ".idx"
+INDEX_HIGH = (9,)    # mayor que cualquier (rango, valor)
+
+index_cache = {}     # (db, tabla, índice) -> {"base", "count", "keys", "positions"}
+index_lock = threading.Lock()
+
+def index_file(db, table, name):
+    return os.path.join(DATA_DIR, db, f"{table}.{name}{INDEX_EXT}")
+
+def index_file_names(db, table):
+    """Archivos de índices (.idx) y de claves únicas (.hash) de la tabla."""
+    db_path = os.path.join(DATA_DIR, db)
+    if not os.path.isdir(db_path):
+        return []
+    prefix = f"{table}."
+    names = []
+    for f in os.listdir(db_path):
+        name, ext = os.path.splitext(f)
+        if ext in (INDEX_EXT, UNIQUE_EXT) and name.startswith(prefix) and is_valid_name(name[len(prefix):]):
+            names.append(f)
+    return names
+
+def _index_rank(value):
+    if value is None:
+        return (0,)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, str(value))
+
+def index_key(columns, row):
+    return tuple(_index_rank(row.get(col)) for col in columns)
+
+def _build_index(columns, rows):
+    keys = [index_key(columns, row) for row in rows]
+    positions = sorted(range(len(rows)), key=keys.__getitem__)
+    return {"keys": [keys[p] for p in positions], "positions": positions, "count": len(rows)}
+
+def write_table_indexes(db, table, data):
+    """Reconstruye y guarda los índices de la tabla (la llama save_table)."""
+    base = _file_stamp(table_file(db, table))
+    for idx in data.get("indexes", []):
+        entry = _build_index(idx["columns"], data["rows"])
+        positions = array("I", entry["positions"])
+        header = json.dumps({
+            "name": idx["name"],
+            "columns": idx["columns"],
+            "table_stamp": base,
+            "typecode": positions.typecode,
+            "byteorder": sys.byteorder
+        }).encode("utf-8")
+        path = index_file(db, table, idx["name"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header + b"\n" + positions.tobytes())
+        os.replace(tmp_path, path)
+        entry["base"] = base
+        with index_lock:
+            index_cache[(db, table, idx["name"])] = entry
+
+def _read_index_file(db, table, idx, rows, base):
+    # Solo vale si se escribió para la versión actual del archivo de la tabla
+    try:
+        with open(index_file(db, table, idx["name"]), "rb") as f:
+            header = json.loads(f.readline().decode("utf-8"))
+            raw = f.read()
+    except (FileNotFoundError, ValueError):
+        return None
+    if header.get("columns") != idx["columns"] or header.get("table_stamp") != list(base or ()):
+        return None
+    positions = array(header["typecode"])
+    positions.frombytes(raw)
+    if header.get("byteorder", sys.byteorder) != sys.byteorder:
+        positions.byteswap()
+    if len(positions) > len(rows):
+        return None
+    positions = positions.tolist()
+    columns = idx["columns"]
+    return {"keys": [index_key(columns, rows[p]) for p in positions], "positions": positions, "count": len(positions)}
+
+def _current_index(db, table, idx, rows):
+    # Se llama con index_lock tomado; rows es la tabla completa (base + log)
+    stamp = table_stamp(db, table)
+    base = stamp[0] if stamp else None
+    key = (db, table, idx["name"])
+    entry = index_cache.get(key)
+    if entry is None or entry["base"] != base or entry["count"] > len(rows):
+        entry = _read_index_file(db, table, idx, rows, base) or _build_index(idx["columns"], rows)
+        entry["base"] = base
+        index_cache[key] = entry
+    if entry["count"] < len(rows):
+        # Filas nuevas del log de inserciones
+        keys, positions = entry["keys"], entry["positions"]
+        for pos in range(entry["count"], len(rows)):
+            k = index_key(idx["columns"], rows[pos])
+            i = bisect_right(keys, k)
+            keys.insert(i, k)
+            positions.insert(i, pos)
+        entry["count"] = len(rows)
+    return entry
+
+def index_invalidate(db, table=None):
+    with index_lock:
+        for cache in (index_cache, unique_cache):
+            for key in [k for k in cache if k[0] == db and (table is None or k[1] == table)]:
+                del cache[key]
+
+def index_candidates(db, table, table_data, conditions):
+    """
+    Posiciones (ordenadas) de las filas que pueden cumplir conditions usando el
+    mejor índice de la tabla, o None si ningún índice sirve. conditions es
+    {columna: {"eq": [valores]} o {"lo": (valor, inclusivo), "hi": (...)}}.
+    Quien llama vuelve a evaluar la condición completa sobre esas filas.
+    """
+    best, best_score = None, (0, 0)
+    for idx in table_data.get("indexes", []):
+        prefix = 0
+        while prefix < len(idx["columns"]) and "eq" in conditions.get(idx["columns"][prefix], {}):
+            prefix += 1
+        has_range = prefix < len(idx["columns"]) and bool(conditions.get(idx["columns"][prefix]))
+        if (prefix, has_range) > best_score:
+            best, best_score = idx, (prefix, has_range)
+    if best is None:
+        return None
+    prefix, has_range = best_score
+    # Sin constantes repetidas (IN (1, 1.0)): cada combinación es un tramo
+    # distinto del índice y ninguna fila sale dos veces
+    eq_values = [list(dict.fromkeys(_index_rank(v) for v in conditions[col]["eq"]))
+                 for col in best["columns"][:prefix]]
+    bounds = conditions[best["columns"][prefix]] if has_range else {}
+    with index_lock:
+        entry = _current_index(db, table, best, table_data["rows"])
+        keys, positions = entry["keys"], entry["positions"]
+        found = []
+        for combo in product(*eq_values):
+            start, end = _index_range(keys, combo, bounds, has_range)
+            found.extend(positions[start:end])
+    found.sort()
+    return found
+
+def _index_range(keys, combo, bounds, has_range):
+    # Tramo [start, end) de las claves con prefijo combo dentro de bounds
+    lo, hi = bounds.get("lo"), bounds.get("hi")
+    if lo is not None:
+        lo_key = combo + (_index_rank(lo[0]),)
+        start = bisect_left(keys, lo_key) if lo[1] else bisect_right(keys, lo_key + (INDEX_HIGH,))
+    else:
+        # Un rango sin límite inferior no incluye NULL
+        start = bisect_left(keys, combo + ((1,),) if has_range else combo)
+    if hi is not None:
+        hi_key = combo + (_index_rank(hi[0]),)
+        end = bisect_right(keys, hi_key + (INDEX_HIGH,)) if hi[1] else bisect_left(keys, hi_key)
+    else:
+        end = bisect_right(keys, combo + (INDEX_HIGH,))
+    return start, end
+
+def index_ordered_positions(db, table, table_data, conditions, order):
+    """
+    Posiciones de las filas candidatas en el orden de ORDER BY `order` (una
+    sola clave) usando un índice cuya siguiente columna tras un prefijo de
+    igualdades es la de orden, o None si ningún índice sirve. Es el camino de
+    la paginación por llave (WHERE llave > último ORDER BY llave LIMIT n): el
+    llamador recorre las posiciones en orden y se detiene con LIMIT, sin
+    ordenar todas las filas que cumplen.
+    """
+    col, desc = order["col"], order["desc"]
+    best = None
+    for idx in table_data.get("indexes", []):
+        prefix = 0
+        while prefix < len(idx["columns"]) and len(conditions.get(idx["columns"][prefix], {}).get("eq", ())) == 1:
+            prefix += 1
+        if prefix < len(idx["columns"]) and idx["columns"][prefix] == col:
+            best = idx
+            break
+    bounds = conditions.get(col, {})
+    if best is None or "eq" in bounds:
+        return None
+    has_range = bool(bounds)
+    # El índice pone NULL al principio: sin un rango que los excluya, el orden
+    # de los NULL pedido debe coincidir con el del índice
+    if not has_range and order["nulls_first"] == desc:
+        return None
+    combo = tuple(_index_rank(conditions[c]["eq"][0]) for c in best["columns"][:prefix])
+    with index_lock:
+        entry = _current_index(db, table, best, table_data["rows"])
+        start, end = _index_range(entry["keys"], combo, bounds, has_range)
+        # Copias: la entrada del índice puede crecer cuando se suelta el candado
+        keys = entry["keys"][start:end]
+        positions = entry["positions"][start:end]
+    return _ordered_positions(keys, positions, prefix, desc)
+
+def _ordered_positions(keys, positions, prefix, desc):
+    # Grupos de igual valor en la columna de orden, ascendentes o descendentes;
+    # dentro de un grupo va el orden de la tabla, como el sort estable de
+    # order_and_limit. Es perezoso: LIMIT deja de pedir posiciones.
+    if not desc:
+        i, n = 0, len(keys)
+        while i < n:
+            j = i + 1
+            while j < n and keys[j][prefix] == keys[i][prefix]:
+                j += 1
+            yield from sorted(positions[i:j])
+            i = j
+    else:
+        j = len(keys)
+        while j > 0:
+            i = j - 1
+            while i > 0 and keys[i - 1][prefix] == keys[j - 1][prefix]:
+                i -= 1
+            yield from sorted(positions[i:j])
+            j = i
+
+def where_index_conditions(expr, columns):
+    """Condiciones indexables (columna op constante) de los AND del WHERE."""
+    types = {col["name"]: re.match(r'^([A-Z]+)', col["type"].upper()).group(1) for col in columns}
+    def value(col, const):
+        # Solo si el índice ordena igual que el predicado compilado
+        number = _as_number(const) if const is not None else None
+        if types[col] in INT_TYPES + DECIMAL_TYPES + ('BIT',):
+            return number
+        return const if number is None else None
+    parts, conditions = [expr], {}
+    while parts:
+        part = parts.pop()
+        while isinstance(part, exp.Paren):
+            part = part.this
+        if isinstance(part, exp.And):
+            parts.extend([part.this, part.expression])
+            continue
+        cond = None
+        if type(part) in COMPARISON_OPERATORS and not isinstance(part, exp.NEQ):
+            left, right, op = part.this, part.expression, COMPARISON_OPERATORS[type(part)]
+            if isinstance(right, exp.Column) and not isinstance(left, exp.Column):
+                left, right, op = right, left, FLIPPED_OPERATORS[op]
+            if not isinstance(left, exp.Column) or left.name not in types:
+                continue
+            try:
+                _, const, is_const = _compile_operand(right)
+            except ValueError:
+                continue
+            v = value(left.name, const) if is_const else None
+            if v is None:
+                continue
+            col = left.name
+            cond = {"eq": [v]} if op is operator.eq else {
+                ("lo" if op in (operator.gt, operator.ge) else "hi"): (v, op in (operator.ge, operator.le))}
+        elif isinstance(part, exp.Between) and isinstance(part.this, exp.Column) and part.this.name in types:
+            try:
+                low, high = _compile_operand(part.args["low"]), _compile_operand(part.args["high"])
+            except ValueError:
+                continue
+            col = part.this.name
+            lo = value(col, low[1]) if low[2] else None
+            hi = value(col, high[1]) if high[2] else None
+            if lo is None or hi is None:
+                continue
+            cond = {"lo": (lo, True), "hi": (hi, True)}
+        elif isinstance(part, exp.In) and isinstance(part.this, exp.Column) and part.this.name in types and not part.args.get("query"):
+            col = part.this.name
+            try:
+                operands = [_compile_operand(e) for e in part.expressions]
+            except ValueError:
+                continue
+            values = [value(col, o[1]) if o[2] else None for o in operands]
+            if not values or any(v is None for v in values):
+                continue
+            cond = {"eq": values}
+        if cond is None:
+            continue
+        # Una igualdad gana a un rango; dos rangos sobre la misma columna se combinan
+        current = conditions.setdefault(col, {})
+        if "eq" in current:
+            continue
+        if "eq" in cond:
+            conditions[col] = cond
+        else:
+            for bound in cond:
+                current.setdefault(bound, cond[bound])
+    return conditions
+
+def record_index_conditions(record):
+    """Condición indexable de un UPDATE/DELETE con valores ya tipados."""
+    if not record.get("typed") or record["op"] not in ("update", "delete"):
+        return None
+    op = record.get("operator", "=")
+    value = record["where_val"]
+    if value is None or op == "!=":
+        return None
+    # Texto con forma de número: el WHERE lo compara como número y el índice
+    # lo ordena como texto (igual que where_index_conditions, no se usa)
+    if isinstance(value, str) and _as_number(value) is not None:
+        return None
+    if op == "=":
+        return {record["where_col"]: {"eq": [value]}}
+    bound = "lo" if op in (">", ">=") else "hi"
+    return {record["where_col"]: {bound: (value, op in (">=", "<="))}}
+
+# ==========================
+# CLAVES ÚNICAS (PRIMARY KEY / UNIQUE)
+# ==========================
+# Las restricciones se declaran en CREATE TABLE y se guardan en el header de
+# la tabla ("unique": [{"name", "columns", "primary"}]). Cada una tiene un
+# índice hash persistente, <tabla>.<restricción>.hash, con el conjunto de
+# claves de las filas del archivo base; save_table lo reescribe junto con la
+# tabla. Un INSERT por el log de inserciones no carga la tabla: consulta el
+# conjunto en memoria (archivo .hash + claves del log) en O(1) por fila y le
+# agrega las claves nuevas. Las escrituras que reescriben la tabla completa
+# (UPDATE, COMMIT) la validan entera antes de registrarse en el WAL.
+# Estas funciones se usan con el candado de escritura de la tabla tomado.
+UNIQUE_EXT = ".hash"
+
+unique_cache = {}    # (db, tabla, restricción) -> {"stamp", "keys": set}
+
+def unique_file(db, table, name):
+    return os.path.join(DATA_DIR, db, f"{table}.{name}{UNIQUE_EXT}")
+
+def unique_key(columns, row):
+    return tuple(row.get(col) for col in columns)
+
+def _unique_keys(constraint, rows):
+    columns = constraint["columns"]
+    return {k for k in (unique_key(columns, row) for row in rows) if None not in k}
+
+def write_table_unique_keys(db, table, data):
+    """Guarda el índice hash de cada restricción (la llama save_table)."""
+    base = _file_stamp(table_file(db, table))
+    for constraint in data.get("unique", []):
+        keys = _unique_keys(constraint, data["rows"])
+        path = unique_file(db, table, constraint["name"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"columns": constraint["columns"], "table_stamp": base, "keys": list(keys)}, f)
+        os.replace(tmp_path, path)
+        unique_cache[(db, table, constraint["name"])] = {"stamp": table_stamp(db, table), "keys": keys}
+
+def _current_unique_keys(db, table, constraint):
+    stamp = table_stamp(db, table)
+    cache_key = (db, table, constraint["name"])
+    entry = unique_cache.get(cache_key)
+    if entry is not None and entry["stamp"] == stamp:
+        return entry["keys"]
+    keys = None
+    try:
+        with open(unique_file(db, table, constraint["name"]), "r") as f:
+            saved = json.load(f)
+        if saved["columns"] == constraint["columns"] and saved["table_stamp"] == list(stamp[0]):
+            keys = set(map(tuple, saved["keys"]))
+            log_rows, _ = read_row_log(db, table)
+            keys.update(_unique_keys(constraint, log_rows))
+    except (FileNotFoundError, ValueError, TypeError):
+        pass
+    if keys is None:
+        # Archivo ausente o de otra versión de la tabla: se reconstruye
+        keys = _unique_keys(constraint, (load_table(db, table) or {"rows": []})["rows"])
+    unique_cache[cache_key] = {"stamp": stamp, "keys": keys}
+    return keys
+
+def _unique_violation(constraint, key):
+    label = "clave primaria" if constraint.get("primary") else f'restricción UNIQUE {constraint["name"]}'
+    if None in key:
+        return ValueError(f'La {label} ({", ".join(constraint["columns"])}) no puede ser NULL')
+    shown = key[0] if len(key) == 1 else key
+    return ValueError(f'Valor duplicado {shown!r} para la {label} ({", ".join(constraint["columns"])})')
+
+def check_unique_insert(db, table, constraints, rows):
+    """
+    Verifica que las filas nuevas no repitan claves existentes ni entre sí.
+    Devuelve las claves nuevas de cada restricción para registrarlas después
+    de escribir (register_unique_keys).
+    """
+    pending = []
+    for constraint in constraints:
+        keys = _current_unique_keys(db, table, constraint)
+        new_keys = set()
+        for row in rows:
+            key = unique_key(constraint["columns"], row)
+            if None in key:
+                if constraint.get("primary"):
+                    raise _unique_violation(constraint, key)
+                continue
+            if key in keys or key in new_keys:
+                raise _unique_violation(constraint, key)
+            new_keys.add(key)
+        pending.append((constraint, new_keys))
+    return pending
+
+def register_unique_keys(db, table, pending):
+    stamp = table_stamp(db, table)
+    for constraint, new_keys in pending:
+        entry = unique_cache.get((db, table, constraint["name"]))
+        if entry is not None:
+            entry["keys"].update(new_keys)
+            entry["stamp"] = stamp
+
+def check_unique_rows(table_data):
+    """Valida todas las filas de una tabla en memoria contra sus restricciones."""
+    for constraint in table_data.get("unique", []):
+        seen = set()
+        for row in table_data["rows"]:
+            key = unique_key(constraint["columns"], row)
+            if None in key:
+                if constraint.get("primary"):
+                    raise _unique_violation(constraint, key)
+                continue
+            if key in seen:
+                raise _unique_violation(constraint, key)
+            seen.add(key)
+
+def touches_unique(table_data, record):
+    """Indica si el registro puede crear claves repetidas (un DELETE nunca)."""
+    constraints = table_data.get("unique", [])
+    if not constraints or record["op"] == "delete":
+        return False
+    if record["op"] == "update":
+        return any(record["set_col"] in c["columns"] for c in constraints)
+    return True
+
+# ==========================
+# CATÁLOGO DE ESQUEMAS
+# ==========================
+# Por base de datos se mantiene en memoria (y en data/<db>/.catalog) el
+# esquema, el número de filas y el tamaño en disco de cada tabla. save_table,
+# append_rows y el DDL lo actualizan, así /databases, /tables y /columns
+# responden sin listar directorios ni abrir archivos de tablas. Cada entrada
+# guarda la huella (mtime, tamaño) de los archivos de la tabla: al cargar el
+# catálogo de una base, las entradas cuya huella no coincide (por ejemplo tras
+# una caída antes de guardarlo) se rehacen desde el header de la tabla, así
+# que basta con escribirlo en cada checkpoint del WAL y al apagar.
+# catalog_state["version"] sube con cada cambio.
+CATALOG_FILE = ".catalog"
+
+catalog_state = {"databases": None, "version": 0, "dirty": set()}
+# El contador se reinicia con el proceso; el id de arranque evita repetir ETags
+CATALOG_BOOT_ID = uuid.uuid4().hex[:8]
+catalog_lock = threading.RLock()
+
+def _catalog_path(db):
+    return os.path.join(DATA_DIR, db, CATALOG_FILE)
+
+def _stamp_json(stamp):
+    return json.loads(json.dumps(stamp))
+
+def _catalog_entry_from_disk(db, table):
+    try:
+        with open(table_file(db, table), "rb") as f:
+            header = _read_header(f)
+        log_rows, _ = read_row_log(db, table)
+        row_count = header["row_count"] + len(log_rows)
+    except FileNotFoundError:
+        header = load_table(db, table)
+        if not header:
+            return None
+        row_count = len(header["rows"])
+    return _catalog_entry(db, table, header, row_count)
+
+def _catalog_entry(db, table, data, row_count):
+    stamp = table_stamp(db, table)
+    return {
+        "columns": data["columns"],
+        "unique": data.get("unique", []),
+        "indexes": data.get("indexes", []),
+        "row_count": row_count,
+        "size": _stamp_bytes(stamp) // BUFFER_POOL_EXPANSION if stamp else 0,
+        "stamp": _stamp_json(stamp)
+    }
+
+def _catalog_databases():
+    # Se llama con catalog_lock tomado; la primera vez lista DATA_DIR
+    if catalog_state["databases"] is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        catalog_state["databases"] = {
+            d: None for d in sorted(os.listdir(DATA_DIR)) if os.path.isdir(os.path.join(DATA_DIR, d))
+        }
+    return catalog_state["databases"]
+
+def _catalog_tables(db):
+    # Se llama con catalog_lock tomado; carga y valida el catálogo de la base
+    databases = _catalog_databases()
+    if db not in databases:
+        return None
+    if databases[db] is None:
+        try:
+            with open(_catalog_path(db), "r") as f:
+                saved = json.load(f)["tables"]
+        except (FileNotFoundError, ValueError, KeyError):
+            saved = {}
+        tables = {}
+        for table in list_table_names(db):
+            entry = saved.get(table)
+            if entry is None or entry.get("stamp") != _stamp_json(table_stamp(db, table)):
+                entry = _catalog_entry_from_disk(db, table)
+            if entry is not None:
+                tables[table] = entry
+        databases[db] = tables
+        if tables != saved:
+            catalog_state["dirty"].add(db)
+    return databases[db]
+
+def _catalog_changed(db):
+    catalog_state["version"] += 1
+    catalog_state["dirty"].add(db)
+
+def catalog_flush(db=None):
+    """Escribe a disco el catálogo de las bases modificadas (o solo de db)."""
+    with catalog_lock:
+        pending = [db] if db is not None else list(catalog_state["dirty"])
+        for name in pending:
+            catalog_state["dirty"].discard(name)
+            tables = (catalog_state["databases"] or {}).get(name)
+            if tables is None or not os.path.isdir(os.path.join(DATA_DIR, name)):
+                continue
+            path = _catalog_path(name)
+            with open(path + ".tmp", "w") as f:
+                json.dump({"tables": tables}, f)
+            os.replace(path + ".tmp", path)
+
+def catalog_table_saved(db, table, data):
+    with catalog_lock:
+        _catalog_databases().setdefault(db, None)
+        tables = _catalog_tables(db)
+        tables[table] = _catalog_entry(db, table, data, len(data["rows"]))
+        _catalog_changed(db)
+
+def catalog_rows_appended(db, table, count):
+    with catalog_lock:
+        tables = _catalog_tables(db)
+        entry = tables.get(table) if tables is not None else None
+        if entry is None:
+            return
+        entry["row_count"] += count
+        stamp = table_stamp(db, table)
+        entry["size"] = _stamp_bytes(stamp) // BUFFER_POOL_EXPANSION
+        entry["stamp"] = _stamp_json(stamp)
+        _catalog_changed(db)
+
+def catalog_drop_table(db, table):
+    with catalog_lock:
+        tables = _catalog_tables(db)
+        if tables is not None and tables.pop(table, None) is not None:
+            _catalog_changed(db)
+
+def catalog_rename_table(db, table, new_table):
+    with catalog_lock:
+        tables = _catalog_tables(db)
+        if tables is not None and table in tables:
+            tables[new_table] = tables.pop(table)
+            tables[new_table]["stamp"] = _stamp_json(table_stamp(db, new_table))
+            _catalog_changed(db)
+
+def catalog_add_database(db):
+    with catalog_lock:
+        databases = _catalog_databases()
+        if db not in databases:
+            databases[db] = {}
+            _catalog_changed(db)
+
+def catalog_drop_database(db):
+    with catalog_lock:
+        _catalog_databases().pop(db, None)
+        catalog_state["dirty"].discard(db)
+        catalog_state["version"] += 1
+
+def catalog_rename_database(db, new_db):
+    with catalog_lock:
+        databases = _catalog_databases()
+        databases.pop(db, None)
+        # Las huellas no cambian con el rename del directorio; se revalida al cargar
+        databases[new_db] = None
+        catalog_state["dirty"].discard(db)
+        catalog_state["version"] += 1
+
+def catalog_list_databases():
+    with catalog_lock:
+        return list(_catalog_databases())
+
+def catalog_list_tables(db):
+    with catalog_lock:
+        tables = _catalog_tables(db)
+        return None if tables is None else list(tables)
+
+def catalog_table(db, table):
+    """Entrada del catálogo de la tabla (columns, unique, indexes, row_count, size) o None."""
+    with catalog_lock:
+        tables = _catalog_tables(db)
+        return None if tables is None else tables.get(table)
+
+def catalog_version():
+    """Versión del catálogo; leerla no toca disco."""
+    return f"{CATALOG_BOOT_ID}-{catalog_state['version']}"
+
+def catalog_snapshot():
+    """Todas las bases, tablas y columnas del catálogo junto con la versión que describen."""
+    with catalog_lock:
+        databases = []
+        for db in list(_catalog_databases()):
+            tables = _catalog_tables(db) or {}
+            databases.append({
+                "name": db,
+                "tables": [{
+                    "name": table,
+                    "columns": entry["columns"],
+                    "row_count": entry["row_count"]
+                } for table, entry in sorted(tables.items())]
+            })
+        return catalog_version(), databases
+
+atexit.register(catalog_flush)
+
+# ==========================
+# WRITE-AHEAD LOG
+# ==========================
+# Toda mutación (INSERT, UPDATE, DELETE, restauración de respaldos) se
+# registra primero en data/fulldb.wal como una línea "crc32 json" con un LSN
+# creciente. El registro se sincroniza a disco (fsync) ANTES de tocar los
+# archivos de la tabla. Los INSERT solo agregan líneas al log de inserciones,
+# que no necesita fsync por sentencia: si se pierde la cola, el WAL la
+# reaplica. Reescribir el archivo base (save_table) sí hace fsync del
+# temporal y del directorio antes de dar la escritura por hecha, porque la
+# reaplicación es lógica y necesita una base completa sobre la cual trabajar.
+# El fsync del WAL se hace en grupo: el primer hilo que llega sincroniza todo
+# lo escrito hasta ese momento y los demás que esperaban ya quedan cubiertos.
+# Cada tabla guarda el LSN de la última mutación aplicada; al arrancar,
+# wal_recover() reaplica los registros con LSN mayor. Cuando el WAL supera
+# WAL_CHECKPOINT_BYTES se hace un checkpoint: fsync de los logs de
+# inserciones escritos y se descartan los registros que ya quedaron en ellos.
+WAL_FILE_NAME = "fulldb.wal"
+WAL_CHECKPOINT_BYTES = 8 * 1024 * 1024
+# Espera antes del fsync para que más escrituras concurrentes entren al grupo
+WAL_GROUP_COMMIT_WINDOW = 0.001
+
+wal_lock = threading.Lock()
+wal_sync_lock = threading.Lock()
+wal_state = {
+    "file": None,
+    "size": 0,
+    "next_lsn": 1,
+    "written_lsn": 0,
+    "synced_lsn": 0,
+    "inflight": set(),
+    "dirty": set(),
+}
+
+def wal_path():
+    return os.path.join(DATA_DIR, WAL_FILE_NAME)
+
+def _wal_encode(entry):
+    payload = json.dumps(entry, separators=(",", ":")).encode("utf-8")
+    return b"%08x " % zlib.crc32(payload) + payload + b"\n"
+
+def _wal_read_entries():
+    """Lee las entradas válidas del WAL; se detiene en la primera línea corrupta o incompleta."""
+    try:
+        with open(wal_path(), "rb") as f:
+            lines = f.read().split(b"\n")
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in lines:
+        crc, _, payload = line.partition(b" ")
+        try:
+            if int(crc, 16) != zlib.crc32(payload):
+                break
+            entries.append(json.loads(payload))
+        except ValueError:
+            break
+    return entries
+
+def _max_table_lsn():
+    """Mayor LSN ya aplicado en los archivos de las tablas (headers y logs de inserciones)."""
+    max_lsn = 0
+    if not os.path.isdir(DATA_DIR):
+        return 0
+    for db in os.listdir(DATA_DIR):
+        db_path = os.path.join(DATA_DIR, db)
+        if not os.path.isdir(db_path):
+            continue
+        for f in os.listdir(db_path):
+            if f.endswith(TABLE_EXT):
+                table = f[:-len(TABLE_EXT)]
+                try:
+                    with open(table_file(db, table), "rb") as tf:
+                        max_lsn = max(max_lsn, _read_header(tf).get("lsn", 0))
+                except (OSError, ValueError):
+                    continue
+                max_lsn = max(max_lsn, read_row_log(db, table)[1])
+    return max_lsn
+
+def _wal_open():
+    # Se llama con wal_lock tomado
+    if wal_state["file"] is not None:
+        return
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # Una tabla puede haber llegado a disco con un LSN cuyo registro no alcanzó
+    # a sincronizarse en el WAL, así que el contador arranca después de ambos
+    last = _max_table_lsn()
+    if os.path.exists(wal_path()):
+        entries = _wal_read_entries()
+        last = max([last] + [max(e.get("lsn", 0), e.get("checkpoint", 0)) for e in entries])
+        # Se reescribe solo la parte válida para descartar una cola truncada
+        _wal_rewrite(entries)
+    else:
+        _wal_rewrite([{"checkpoint": last}])
+    wal_state["next_lsn"] = last + 1
+    wal_state["written_lsn"] = wal_state["synced_lsn"] = last
+
+def _wal_rewrite(entries):
+    # Se llama con wal_lock tomado
+    if wal_state["file"] is not None:
+        wal_state["file"].close()
+    tmp_path = wal_path() + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for entry in entries:
+            f.write(_wal_encode(entry))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, wal_path())
+    wal_state["file"] = open(wal_path(), "ab")
+    wal_state["size"] = wal_state["file"].tell()
+
+def wal_append(record):
+    """Escribe el registro en el WAL (sin fsync) y devuelve su LSN."""
+    with wal_lock:
+        _wal_open()
+        lsn = wal_state["next_lsn"]
+        wal_state["next_lsn"] += 1
+        line = _wal_encode({"lsn": lsn, **record})
+        wal_state["file"].write(line)
+        wal_state["size"] += len(line)
+        wal_state["written_lsn"] = lsn
+        wal_state["inflight"].add(lsn)
+        return lsn
+
+def wal_sync(lsn):
+    """Group commit: espera a que el registro `lsn` esté en disco."""
+    if wal_state["synced_lsn"] >= lsn:
+        return
+    with wal_sync_lock:
+        # Otro hilo pudo haber sincronizado este LSN mientras esperábamos
+        if wal_state["synced_lsn"] >= lsn:
+            return
+        if WAL_GROUP_COMMIT_WINDOW:
+            time.sleep(WAL_GROUP_COMMIT_WINDOW)
+        with wal_lock:
+            target = wal_state["written_lsn"]
+            wal_state["file"].flush()
+            fd = wal_state["file"].fileno()
+        # El fsync va fuera de wal_lock para que otros hilos sigan escribiendo
+        # el siguiente grupo; el checkpoint toma wal_sync_lock antes de cerrar el archivo
+        os.fsync(fd)
+        wal_state["synced_lsn"] = target
+
+def wal_done(lsn):
+    """Marca el registro como aplicado a los archivos de la tabla."""
+    with wal_lock:
+        wal_state["inflight"].discard(lsn)
+        needs_checkpoint = wal_state["size"] >= WAL_CHECKPOINT_BYTES
+    if needs_checkpoint:
+        wal_checkpoint()
+
+def wal_current_lsn():
+    with wal_lock:
+        _wal_open()
+        return wal_state["next_lsn"] - 1
+
+def wal_mark_dirty(path):
+    """Registra un archivo escrito sin fsync para sincronizarlo en el próximo checkpoint."""
+    with wal_lock:
+        wal_state["dirty"].add(path)
+
+def wal_checkpoint():
+    """Sincroniza las tablas escritas y recorta del WAL los registros ya aplicados."""
+    with wal_sync_lock, wal_lock:
+        _wal_open()
+        if wal_state["inflight"]:
+            redo_lsn = min(wal_state["inflight"]) - 1
+        else:
+            redo_lsn = wal_state["next_lsn"] - 1
+        dirty, wal_state["dirty"] = wal_state["dirty"], set()
+        for path in dirty:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        wal_state["file"].flush()
+        pending = [e for e in _wal_read_entries() if e.get("lsn", 0) > redo_lsn]
+        _wal_rewrite([{"checkpoint": redo_lsn}] + pending)
+        wal_state["synced_lsn"] = wal_state["written_lsn"]
+    catalog_flush()
+
+def wal_recover():
+    """Reaplica los registros del WAL que no alcanzaron a llegar a las tablas."""
+    by_table = OrderedDict()
+    for entry in _wal_read_entries():
+        if entry.get("op") == "txn":
+            # Una transacción se reparte entre sus tablas con el mismo LSN
+            for change in entry["changes"]:
+                by_table.setdefault((change["db"], change["table"]), []).append(
+                    {"lsn": entry["lsn"], "op": "batch", "records": change["records"]})
+        elif "lsn" in entry:
+            by_table.setdefault((entry["db"], entry["table"]), []).append(entry)
+    replayed = 0
+    for (db, table), records in by_table.items():
+        if not table_exists(db, table):
+            continue
+        table_data = load_table(db, table)
+        pending = [r for r in records if r["lsn"] > table_data.get("lsn", 0)]
+        if not pending:
+            continue
+        for record in pending:
+            apply_mutation(table_data, record)
+        table_data["lsn"] = pending[-1]["lsn"]
+        save_table(db, table, table_data)
+        replayed += len(pending)
+    wal_checkpoint()
+    return replayed
+
 # ==========================
 # FUNCIONES UTILITARIAS
 # ==========================
+def fsync_dir(path):
+    """Sincroniza el directorio para que un os.replace sobreviva a un corte de luz."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Algunas plataformas (Windows) no permiten fsync de directorios
+        pass
+    finally:
+        os.close(fd)
+
 def save_table(db, table, data):
     os.makedirs(os.path.join(DATA_DIR, db), exist_ok=True)
-    with open(os.path.join(DATA_DIR, db, f"{table}.json"), "w") as f:
-        json.dump(data, f)
+    path = table_file(db, table)
+    # Se escribe a un temporal, se sincroniza y se reemplaza para no dejar
+    # tablas truncadas; el WAL no puede reconstruir una base perdida
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_table(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # La tabla guardada ya incluye las filas del log de inserciones
+    try:
+        os.remove(row_log_file(db, table))
+    except FileNotFoundError:
+        pass
+    write_table_indexes(db, table, data)
+    write_table_unique_keys(db, table, data)
+    catalog_table_saved(db, table, data)
+    fsync_dir(os.path.dirname(path))
+    pool_put(db, table, data, table_stamp(db, table))
 
 def is_valid_name(name):
     return re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', name) is not None
 
 def load_table(db, table):
+    stamp = table_stamp(db, table)
+    if stamp is not None:
+        cached = pool_get(db, table, stamp)
+        if cached is not None:
+            return cached
     try:
-        with open(os.path.join(DATA_DIR, db, f"{table}.json"), "r") as f:
-            return json.load(f)
+        with open(table_file(db, table), "rb") as f:
+            table_data = decode_table(f.read())
     except FileNotFoundError:
-        return []
+        try:
+            table_data = migrate_table(db, table)
+        except FileNotFoundError:
+            return []
+        stamp = table_stamp(db, table)
+    log_rows, log_lsn = read_row_log(db, table)
+    table_data["rows"].extend(log_rows)
+    table_data["lsn"] = max(table_data.get("lsn", 0), log_lsn)
+    pool_put(db, table, table_data, stamp)
+    return _table_view(table_data)
+
+def load_table_schema(db, table):
+    """Esquema de la tabla (columnas y restricciones) sin decodificar filas."""
+    entry = catalog_table(db, table)
+    if entry is not None:
+        return {"columns": entry["columns"], "unique": entry["unique"]}
+    try:
+        with open(table_file(db, table), "rb") as f:
+            header = _read_header(f)
+        return {"columns": header["columns"], "unique": header.get("unique", [])}
+    except FileNotFoundError:
+        table_data = load_table(db, table)
+        if not table_data:
+            return None
+        return {"columns": table_data["columns"], "unique": table_data.get("unique", [])}
+
+# Tipos de columna: los valores se guardan ya convertidos al tipo declarado
+# (int, float, bool o str), así las comparaciones y agregaciones no tienen que
+# convertir cada fila. Las fechas se guardan como texto ISO, que ordena bien.
+INT_TYPES = ('INT', 'BIGINT')
+DECIMAL_TYPES = ('DECIMAL', 'FLOAT', 'NUMERIC')
+DATE_TYPES = ('DATE', 'DATETIME', 'TIMESTAMP')
+BOUNDED_TEXT_TYPES = ('VARCHAR', 'CHAR', 'NVARCHAR')
+BIT_VALUES = {'0': False, '1': True, 'true': True, 'false': False}
 
-def backup_table(db, table, data):
+def coerce_value(col, val):
+    """Convierte val al tipo declarado de la columna; lanza ValueError si no es válido."""
+    if val is None:
+        return None
+    col_name = col["name"]
+    col_type = col["type"].upper()
+    base_type = re.match(r'^([A-Z]+)', col_type).group(1)
+    if base_type in INT_TYPES:
+        if isinstance(val, int) and not isinstance(val, bool):
+            return val
+        val = str(val).strip()
+        if val == "":
+            return None
+        if not re.match(r'^-?\d+$', val):
+            raise ValueError(f'El valor para {col_name} debe ser un entero')
+        return int(val)
+    if base_type in DECIMAL_TYPES:
+        if isinstance(val, (int, float)) and not isinstance(val, bool):
+            return float(val)
+        val = str(val).strip()
+        if val == "":
+            return None
+        if not re.match(r'^-?\d+(\.\d+)?$', val):
+            raise ValueError(f'El valor para {col_name} debe ser numérico')
+        return float(val)
+    if base_type == 'BIT':
+        if isinstance(val, bool):
+            return val
+        val = str(val).strip()
+        if val == "":
+            return None
+        if val.lower() not in BIT_VALUES:
+            raise ValueError(f'El valor para {col_name} debe ser booleano (0/1 o True/False)')
+        return BIT_VALUES[val.lower()]
+    val = str(val)
+    if base_type in DATE_TYPES:
+        if val.strip() == "":
+            return None
+        try:
+            datetime.datetime.fromisoformat(val)
+        except Exception:
+            raise ValueError(f'El valor para {col_name} debe ser una fecha válida (YYYY-MM-DD o similar)')
+    elif base_type in BOUNDED_TEXT_TYPES:
+        # Extraer longitud si existe, por ejemplo VARCHAR(20)
+        length_match = re.search(r'\((\d+)\)', col_type)
+        if length_match:
+            max_len = int(length_match.group(1))
+            if len(val) > max_len:
+                raise ValueError(f'El valor para {col_name} excede la longitud máxima de {max_len} caracteres')
+            if base_type == 'CHAR' and len(val) != max_len:
+                raise ValueError(f'El valor para {col_name} debe tener exactamente {max_len} caracteres')
+    return val
+
+def coerce_row(columns, row):
+    """Devuelve una copia de row con cada columna del esquema convertida a su tipo."""
+    typed = dict(row)
+    for col in columns:
+        if col["name"] in typed:
+            typed[col["name"]] = coerce_value(col, typed[col["name"]])
+    return typed
+
+def coerce_rows_lenient(columns, rows):
+    """Como coerce_row, pero deja tal cual los valores que no se pueden convertir."""
+    def convert(col, val):
+        try:
+            return coerce_value(col, val)
+        except ValueError:
+            return val
+    return [{**row, **{col["name"]: convert(col, row[col["name"]]) for col in columns if col["name"] in row}}
+            for row in rows]
+
+def migrate_typed_tables():
+    """Migración única: convierte los valores de las tablas antiguas (todo texto) a su tipo."""
+    if not os.path.isdir(DATA_DIR):
+        return 0
+    migrated = 0
+    for db in os.listdir(DATA_DIR):
+        if not os.path.isdir(os.path.join(DATA_DIR, db)):
+            continue
+        for table in list_table_names(db):
+            try:
+                with open(table_file(db, table), "rb") as f:
+                    if _read_header(f).get("typed"):
+                        continue
+            except FileNotFoundError:
+                pass
+            table_data = load_table(db, table)
+            if not table_data:
+                continue
+            table_data["rows"] = coerce_rows_lenient(table_data["columns"], table_data["rows"])
+            table_data["typed"] = True
+            save_table(db, table, table_data)
+            migrated += 1
+    return migrated
+
+def backup_table(db, table, data, delta=False):
+    """Escribe un respaldo (completo o delta) y devuelve el nombre del archivo."""
     backup_dir = os.path.join(DATA_DIR, db, "backups")
     os.makedirs(backup_dir, exist_ok=True)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(backup_dir, f"{table}_{timestamp}.json")
-    with open(backup_file, "w") as f:
+    # Microsegundos en el nombre: dos respaldos en el mismo segundo no se pisan
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    name = f"{table}_{timestamp}.delta.json" if delta else f"{table}_{timestamp}.json"
+    path = os.path.join(backup_dir, name)
+    with open(path, "w") as f:
         json.dump(data, f)
+    backup_index_add(db, {
+        "file": name,
+        "table": table,
+        "kind": "delta" if delta else "full",
+        "base": data.get("base"),
+        "size": os.path.getsize(path),
+        "created": time.time()
+    })
+    return name
+
+def read_backup(db, backup_file):
+    """
+    Devuelve {"columns", "rows"} de un respaldo. Un delta se reconstruye sobre
+    la instantánea completa de la que depende.
+    """
+    backup_dir = os.path.join(DATA_DIR, db, "backups")
+    with open(os.path.join(backup_dir, backup_file), "r") as f:
+        backup_data = json.load(f)
+    if backup_data.get("kind") != "delta":
+        return backup_data
+    with open(os.path.join(backup_dir, backup_data["base"]), "r") as f:
+        base_rows = json.load(f)["rows"]
+    removed = set(backup_data["removed"])
+    kept = iter([row for i, row in enumerate(base_rows) if i not in removed])
+    rows = []
+    for pos, row in backup_data["added"]:
+        while len(rows) < pos:
+            rows.append(next(kept))
+        rows.append(row)
+    rows.extend(kept)
+    return {"columns": backup_data["columns"], "rows": rows}
 
 def parse_db_table(full_name):
     # Elimina alias si existe (por ejemplo: "tienda.clientes AS c" -> "tienda.clientes")
@@ -68,59 +1553,1349 @@ def parse_db_table(full_name):
 def normalizar(texto):
     if texto is None:
         return ""
+    # Con valores tipados un INT 1 y un DECIMAL 1.0 deben dar la misma clave
+    if isinstance(texto, float) and texto.is_integer():
+        texto = int(texto)
     # Quita acentos, pasa a minúsculas y elimina espacios extra
     texto = str(texto).strip().lower()
     texto = ''.join(c for c in unicodedata.normalize('NFD', texto)
                     if unicodedata.category(c) != 'Mn')
     return texto
 
-def join_tables(left_rows, right_rows, left_key, right_key):
+def hash_join(left_rows, right_rows, left_key, right_key):
+    """
+    Hash join: construye una tabla hash sobre el lado más pequeño (clave ya
+    normalizada) y la sondea una vez por cada fila del otro lado.
+    Mantiene la semántica de `normalizar` (sin acentos ni mayúsculas) y el
+    mismo orden de salida que el nested loop original (izquierda, luego derecha).
+    """
     result = []
-    for l in left_rows:
+    if not left_rows or not right_rows:
+        return result
+    if len(right_rows) <= len(left_rows):
+        # Build sobre la derecha, probe con la izquierda: el orden sale solo
+        buckets = {}
         for r in right_rows:
-            if normalizar(l.get(left_key)) == normalizar(r.get(right_key)):
-                combined = {**l, **r}
-                result.append(combined)
+            buckets.setdefault(normalizar(r.get(right_key)), []).append(r)
+        for l in left_rows:
+            for r in buckets.get(normalizar(l.get(left_key)), ()):
+                result.append({**l, **r})
+        return result
+    # Build sobre la izquierda, probe con la derecha; se agrupan las
+    # coincidencias por fila izquierda para conservar el orden original
+    buckets = {}
+    for i, l in enumerate(left_rows):
+        buckets.setdefault(normalizar(l.get(left_key)), []).append(i)
+    matches = {}
+    for r in right_rows:
+        for i in buckets.get(normalizar(r.get(right_key)), ()):
+            matches.setdefault(i, []).append(r)
+    for i in sorted(matches):
+        l = left_rows[i]
+        for r in matches[i]:
+            result.append({**l, **r})
     return result
 
-def group_by_agg(rows, group_col, agg_col, agg_func):
+# Acumuladores de agregación: (inicial, paso, final). El paso recibe el
+# estado y el valor de la fila y devuelve el nuevo estado; NULL no cuenta.
+def _sum_step(state, value):
+    if value is None:
+        return state
+    if isinstance(value, str):
+        value = float(value)
+    # Sin valores previos (estado None) la suma empieza en el primero
+    return value if state is None else state + value
+
+def _min_step(state, value):
+    return value if state is None or (value is not None and value < state) else state
+
+def _max_step(state, value):
+    return value if state is None or (value is not None and value > state) else state
+
+def _avg_step(state, value):
+    if value is not None:
+        state[0] = _sum_step(state[0], value)
+        state[1] += 1
+    return state
+
+def _distinct_step(state, value):
+    if value is not None:
+        state.add(value)
+    return state
+
+def _aggregate_ops(agg):
+    func = agg["func"]
+    if func == "COUNT":
+        if agg["col"] == "*":
+            return (lambda: 0), (lambda state, value: state + 1), None
+        if agg.get("distinct"):
+            return set, _distinct_step, len
+        return (lambda: 0), (lambda state, value: state if value is None else state + 1), None
+    if func == "SUM":
+        # Como en SQL, SUM de un grupo vacío o solo con NULL es NULL
+        return (lambda: None), _sum_step, None
+    if func == "AVG":
+        return (lambda: [0, 0]), _avg_step, (lambda state: state[0] / state[1] if state[1] else None)
+    if func == "MIN":
+        return (lambda: None), _min_step, None
+    if func == "MAX":
+        return (lambda: None), _max_step, None
+    raise ValueError(f'Función de agregación no soportada: {func}')
+
+def aggregate_alias(agg):
+    col = agg["col"].split(".")[-1]
+    func = agg["func"].lower() + ("_distinct" if agg.get("distinct") else "")
+    return agg["alias"] or f"{func}_{col}"
+
+def group_by_agg(rows, group_cols, aggregates):
+    """
+    Hash aggregation: un acumulador por grupo que se actualiza mientras pasan
+    las filas, sin guardar las filas de cada grupo. rows puede ser un iterador.
+    Sin columnas de agrupación hay un único grupo (aunque no haya filas).
+    Devuelve (columnas, filas).
+    """
+    key_names = [col.split(".")[-1] for col in group_cols]
+    aliases = [aggregate_alias(agg) for agg in aggregates]
+    ops = [_aggregate_ops(agg) for agg in aggregates]
+    inits = [op[0] for op in ops]
+    steps = [(agg["col"].split(".")[-1], op[1]) for agg, op in zip(aggregates, ops)]
     groups = {}
+    if not key_names:
+        groups[()] = [init() for init in inits]
     for row in rows:
-        key = row[group_col]
-        groups.setdefault(key, []).append(row)
+        key = tuple([row.get(name) for name in key_names])
+        acc = groups.get(key)
+        if acc is None:
+            acc = groups[key] = [init() for init in inits]
+        for i, (col, step) in enumerate(steps):
+            acc[i] = step(acc[i], row.get(col))
     result = []
-    for key, group_rows in groups.items():
-        if agg_func == "SUM":
-            agg_value = sum(float(r[agg_col]) for r in group_rows)
-        elif agg_func == "COUNT":
-            agg_value = len(group_rows)
+    for key, acc in groups.items():
+        result_row = dict(zip(key_names, key))
+        for alias, (_, _, final), state in zip(aliases, ops, acc):
+            result_row[alias] = final(state) if final else state
+        result.append(result_row)
+    return key_names + aliases, result
+
+def _order_compare(a, b):
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        # Tipos mezclados (tablas antiguas sin tipos): se compara como texto
+        a, b = str(a), str(b)
+        return (a > b) - (a < b)
+
+def order_and_limit(rows, order_by, limit=None, offset=0):
+    """
+    ORDER BY (varias claves, ASC/DESC, NULLS FIRST/LAST) y LIMIT/OFFSET sobre
+    un iterable de filas. Con ORDER BY y LIMIT se usa un heap acotado a
+    offset + limit filas (O(n log k)); sin ORDER BY, LIMIT corta el recorrido
+    apenas hay filas suficientes.
+    """
+    if not order_by:
+        if limit is None and not offset:
+            return rows
+        return islice(rows, offset, None if limit is None else offset + limit)
+    cols = [o["col"] for o in order_by]
+    flags = [(o["desc"], o["nulls_first"]) for o in order_by]
+    def compare(a, b):
+        for x, y, (desc, nulls_first) in zip(a, b, flags):
+            if x is None or y is None:
+                if x is None and y is None:
+                    continue
+                # NULLS FIRST/LAST no se invierte con DESC
+                return -1 if (x is None) == nulls_first else 1
+            result = _order_compare(x, y)
+            if result:
+                return -result if desc else result
+        return 0
+    sort_key = cmp_to_key(compare)
+    key = lambda row: sort_key(tuple([row.get(col) for col in cols]))
+    if limit is None:
+        return sorted(rows, key=key)[offset:]
+    return heapq.nsmallest(offset + limit, rows, key=key)[offset:]
+
+
+# ==========================
+# BLOQUEOS POR TABLA (LECTORES/ESCRITORES)
+# ==========================
+# Cada tabla tiene un candado de lectores/escritores: varios SELECT pueden
+# leerla a la vez, pero las secuencias cargar-modificar-guardar de un mismo
+# escritor se serializan. Los escritores tienen prioridad para no quedarse
+# esperando indefinidamente detrás de lecturas continuas.
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+table_locks = {}
+table_locks_guard = threading.Lock()
+
+def table_lock(db, table):
+    with table_locks_guard:
+        return table_locks.setdefault((db, table), RWLock())
+
+@contextmanager
+def tables_read_locked(*tables):
+    """Toma el candado de lectura de varias tablas (db, tabla) en orden fijo."""
+    locks = [table_lock(db, table) for db, table in sorted(set(tables))]
+    for lock in locks:
+        lock.acquire_read()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release_read()
+
+@contextmanager
+def tables_write_locked(*tables):
+    """Toma el candado de escritura de varias tablas (db, tabla) en orden fijo."""
+    locks = [table_lock(db, table) for db, table in sorted(set(tables))]
+    for lock in locks:
+        lock.acquire_write()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release_write()
+
+def table_write_locked(db, table):
+    return tables_write_locked((db, table))
+
+@contextmanager
+def database_write_locked(db):
+    """Candado de escritura de todas las tablas de la base (DROP/RENAME DATABASE)."""
+    db_path = os.path.join(DATA_DIR, db)
+    tables = list_table_names(db) if os.path.isdir(db_path) else []
+    with tables_write_locked(*[(db, table) for table in tables]):
+        yield
+
+def drop_database_files(db):
+    """Borra la carpeta de la base con los candados de sus tablas tomados."""
+    with database_write_locked(db):
+        if not os.path.exists(os.path.join(DATA_DIR, db)):
+            raise ValueError(f'La base de datos {db} no existe')
+        shutil.rmtree(os.path.join(DATA_DIR, db))
+        pool_invalidate(db)
+        catalog_drop_database(db)
+    result_cache_invalidate(db)
+
+# ==========================
+# RESPALDOS EN SEGUNDO PLANO
+# ==========================
+# UPDATE y DELETE ya no escriben el respaldo en el hilo de la petición: dejan
+# en cola una instantánea de la tabla (la lista de filas antes del cambio; las
+# filas son de solo lectura, así que no se copia nada más) y un hilo de fondo
+# la escribe con backup_table. Si llegan más escrituras a la misma tabla
+# mientras su respaldo sigue en cola (BACKUP_COALESCE_WINDOW segundos), se
+# funden en ese mismo respaldo, que guarda el estado previo a la primera.
+# /backups/status expone qué tan atrasado va el proceso.
+#
+# Los respaldos son incrementales: cada BACKUP_FULL_EVERY respaldos de una
+# tabla se guarda una instantánea completa ({tabla}_{ts}.json) y entre medias
+# solo deltas ({tabla}_{ts}.delta.json) con las filas quitadas (posiciones en
+# la instantánea) y las nuevas o cambiadas (con su posición en el resultado).
+# Cada delta depende solo de su instantánea, así que restaurar cualquier punto
+# es leer dos archivos. Si el delta saldría más grande que
+# BACKUP_DELTA_MAX_RATIO de la tabla, o si cambiaron las columnas, se vuelve a
+# tomar una instantánea completa.
+BACKUP_COALESCE_WINDOW = 2.0
+BACKUP_FULL_EVERY = 10
+BACKUP_DELTA_MAX_RATIO = 0.5
+
+pending_backups = OrderedDict()     # (db, tabla) -> {"data", "queued_at"}
+backup_cond = threading.Condition()
+backup_state = {
+    "worker": None,
+    "compactor": None,
+    "in_progress": None,
+    "completed": 0,
+    "coalesced": 0,
+    "errors": 0,
+    "last_error": None,
+    "last_completed_at": None,
+    "compacted": 0,
+    "last_compaction_at": None,
+}
+# (db, tabla) -> {"file", "columns", "deltas"} de la última instantánea. Las
+# filas no se guardan en memoria: se releen del archivo al calcular un delta
+backup_bases = {}
+
+def schedule_backup(db, table, data):
+    """Encola el respaldo de la tabla (data es el estado antes de la escritura)."""
+    with backup_cond:
+        if (db, table) in pending_backups:
+            backup_state["coalesced"] += 1
+            return
+        pending_backups[(db, table)] = {"data": _table_view(data), "queued_at": time.time()}
+        if backup_state["worker"] is None or not backup_state["worker"].is_alive():
+            backup_state["worker"] = threading.Thread(target=_backup_worker, name="backup-worker", daemon=True)
+            backup_state["worker"].start()
+        if backup_state["compactor"] is None or not backup_state["compactor"].is_alive():
+            backup_state["compactor"] = threading.Thread(target=_backup_compactor, name="backup-compactor", daemon=True)
+            backup_state["compactor"].start()
+        backup_cond.notify_all()
+
+def _next_backup(wait=True):
+    # Se llama con backup_cond tomado; espera a que venza la ventana del más antiguo
+    while pending_backups:
+        key, entry = next(iter(pending_backups.items()))
+        remaining = entry["queued_at"] + BACKUP_COALESCE_WINDOW - time.time()
+        if remaining <= 0 or not wait:
+            del pending_backups[key]
+            backup_state["in_progress"] = (key, entry)
+            return key, entry
+        backup_cond.wait(remaining)
+    return None
+
+def _row_key(columns, row):
+    try:
+        key = tuple(map(row.get, columns))
+        hash(key)
+        return key
+    except TypeError:
+        return json.dumps(row, sort_keys=True)
+
+def diff_rows(columns, base_rows, rows):
+    """
+    Compara rows con base_rows y devuelve (removed, added): índices de
+    base_rows que ya no están y pares [posición, fila] de las filas nuevas.
+    Las filas que se conservan se emparejan en orden, así que un UPDATE o
+    DELETE produce solo las filas que tocó.
+    """
+    positions = {}
+    for i, row in enumerate(base_rows):
+        positions.setdefault(_row_key(columns, row), deque()).append(i)
+    matched = set()
+    added = []
+    last = -1
+    for pos, row in enumerate(rows):
+        candidates = positions.get(_row_key(columns, row))
+        while candidates and candidates[0] <= last:
+            candidates.popleft()
+        if candidates:
+            last = candidates.popleft()
+            matched.add(last)
         else:
-            agg_value = None
-        result.append({group_col: key, f"{agg_func.lower()}_{agg_col}": agg_value})
-    return result
+            added.append([pos, row])
+    removed = [i for i in range(len(base_rows)) if i not in matched]
+    return removed, added
+
+def write_backup(db, table, data):
+    """Escribe el respaldo de la tabla como delta o como instantánea completa."""
+    columns, rows = data.get("columns", []), data.get("rows", [])
+    base = backup_bases.get((db, table))
+    base_rows = None
+    if base is not None and base["deltas"] < BACKUP_FULL_EVERY and base["columns"] == columns:
+        try:
+            base_rows = read_backup(db, base["file"])["rows"]
+        except FileNotFoundError:
+            pass
+    if base_rows is not None:
+        removed, added = diff_rows(columns, base_rows, rows)
+        if len(removed) + len(added) <= BACKUP_DELTA_MAX_RATIO * max(len(rows), 1):
+            backup_table(db, table, {
+                "kind": "delta",
+                "base": base["file"],
+                "columns": columns,
+                "removed": removed,
+                "added": added,
+                "lsn": data.get("lsn", 0)
+            }, delta=True)
+            base["deltas"] += 1
+            return
+    name = backup_table(db, table, {"kind": "full", **data})
+    backup_bases[(db, table)] = {"file": name, "columns": columns, "deltas": 0}
+
+def _write_backup(key, entry):
+    error = None
+    try:
+        write_backup(key[0], key[1], entry["data"])
+    except Exception as e:
+        error = str(e)
+    with backup_cond:
+        if error is None:
+            backup_state["completed"] += 1
+            backup_state["last_completed_at"] = time.time()
+        else:
+            backup_state["errors"] += 1
+            backup_state["last_error"] = error
+        backup_state["in_progress"] = None
+        backup_cond.notify_all()
+
+def _backup_worker():
+    while True:
+        with backup_cond:
+            item = _next_backup()
+            if item is None:
+                backup_cond.wait()
+                continue
+        _write_backup(*item)
+
+def flush_backups():
+    """Escribe ya todos los respaldos en cola (por ejemplo, al apagar el servidor)."""
+    while True:
+        with backup_cond:
+            while backup_state["in_progress"] is not None:
+                backup_cond.wait()
+            item = _next_backup(wait=False)
+        if item is None:
+            return
+        _write_backup(*item)
+
+def backup_status():
+    with backup_cond:
+        now = time.time()
+        oldest = next(iter(pending_backups.values()), None)
+        return {
+            "pending": len(pending_backups) + (1 if backup_state["in_progress"] else 0),
+            "oldest_pending_seconds": now - oldest["queued_at"] if oldest else 0,
+            "completed": backup_state["completed"],
+            "coalesced": backup_state["coalesced"],
+            "errors": backup_state["errors"],
+            "last_error": backup_state["last_error"],
+            "seconds_since_last_backup": now - backup_state["last_completed_at"] if backup_state["last_completed_at"] else None,
+            "compacted": backup_state["compacted"],
+            "last_compaction_at": backup_state["last_compaction_at"]
+        }
+
+atexit.register(flush_backups)
+
+# ==========================
+# RETENCIÓN DE RESPALDOS
+# ==========================
+# Cada base de datos lleva un índice (backups/index.json) con los respaldos
+# que tiene: archivo, tabla, tipo, instantánea base, tamaño y fecha. Así
+# /backups responde sin listar el directorio. Si falta el índice (bases de
+# datos anteriores) se reconstruye una vez escaneando la carpeta.
+#
+# Un hilo compactador aplica cada BACKUP_COMPACT_INTERVAL segundos la política
+# de retención por tabla: los últimos BACKUP_KEEP_LAST, el más reciente de
+# cada una de las últimas BACKUP_KEEP_HOURLY horas y de cada uno de los
+# últimos BACKUP_KEEP_DAILY días. Luego, si la base de datos supera
+# BACKUP_MAX_BYTES_PER_DB, borra los más antiguos (nunca el último de cada
+# tabla). Una instantánea completa no se borra mientras quede un delta que
+# dependa de ella.
+BACKUP_INDEX_FILE = "index.json"
+BACKUP_KEEP_LAST = 20
+BACKUP_KEEP_HOURLY = 24
+BACKUP_KEEP_DAILY = 30
+BACKUP_MAX_BYTES_PER_DB = int(os.environ.get("BACKUP_MAX_BYTES_PER_DB", 1024 * 1024 * 1024))
+BACKUP_COMPACT_INTERVAL = 300
+
+BACKUP_NAME_RE = re.compile(r'^(.+)_(\d{8}_\d{6})(?:_(\d{6}))?(\.delta)?\.json$')
+
+backup_index_lock = threading.Lock()
+
+def backup_index_path(db):
+    return os.path.join(DATA_DIR, db, "backups", BACKUP_INDEX_FILE)
+
+def _scan_backups(db):
+    backup_dir = os.path.join(DATA_DIR, db, "backups")
+    entries = []
+    for name in os.listdir(backup_dir):
+        match = BACKUP_NAME_RE.match(name)
+        if match is None:
+            continue
+        table, stamp, micros, delta = match.groups()
+        created = datetime.datetime.strptime(stamp, "%Y%m%d_%H%M%S").timestamp() + int(micros or 0) / 1e6
+        base = None
+        if delta:
+            with open(os.path.join(backup_dir, name), "r") as f:
+                base = json.load(f).get("base")
+        entries.append({
+            "file": name,
+            "table": table,
+            "kind": "delta" if delta else "full",
+            "base": base,
+            "size": os.path.getsize(os.path.join(backup_dir, name)),
+            "created": created
+        })
+    entries.sort(key=lambda e: e["created"])
+    return entries
+
+def _read_backup_index(db):
+    # Se llama con backup_index_lock tomado
+    try:
+        with open(backup_index_path(db), "r") as f:
+            return json.load(f)["backups"]
+    except FileNotFoundError:
+        if not os.path.isdir(os.path.join(DATA_DIR, db, "backups")):
+            return []
+        entries = _scan_backups(db)
+        _write_backup_index(db, entries)
+        return entries
+
+def _write_backup_index(db, entries):
+    path = backup_index_path(db)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"backups": entries}, f)
+    os.replace(tmp_path, path)
+
+def backup_index_add(db, entry):
+    with backup_index_lock:
+        entries = _read_backup_index(db)
+        if not any(e["file"] == entry["file"] for e in entries):
+            entries.append(entry)
+        _write_backup_index(db, entries)
+
+def get_backup_index(db, table=None):
+    """Respaldos de la base de datos (o de una tabla), del más antiguo al más reciente."""
+    with backup_index_lock:
+        entries = _read_backup_index(db)
+    if table is not None:
+        entries = [e for e in entries if e["table"] == table]
+    return entries
+
+def _retained_backups(entries, now):
+    """Aplica la política por tabla y devuelve el conjunto de archivos a conservar."""
+    keep = set()
+    by_table = {}
+    for e in entries:
+        by_table.setdefault(e["table"], []).append(e)
+    for table_entries in by_table.values():
+        newest_first = sorted(table_entries, key=lambda e: e["created"], reverse=True)
+        keep.update(e["file"] for e in newest_first[:BACKUP_KEEP_LAST])
+        for bucket_seconds, buckets in ((3600, BACKUP_KEEP_HOURLY), (86400, BACKUP_KEEP_DAILY)):
+            seen = set()
+            for e in newest_first:
+                bucket = int(e["created"] // bucket_seconds)
+                if bucket not in seen and bucket > now // bucket_seconds - buckets:
+                    seen.add(bucket)
+                    keep.add(e["file"])
+    return keep
+
+def _with_bases(entries, keep):
+    # Un delta conservado obliga a conservar su instantánea
+    return keep | {e["base"] for e in entries if e["file"] in keep and e["kind"] == "delta"}
+
+def compact_backups(db):
+    """Aplica la política de retención a los respaldos de db. Devuelve cuántos borró."""
+    with backup_index_lock:
+        entries = _read_backup_index(db)
+        if not entries:
+            return 0
+        keep = _with_bases(entries, _retained_backups(entries, time.time()))
+        sizes = {e["file"]: e["size"] for e in entries}
+        total = sum(sizes[f] for f in keep)
+        if total > BACKUP_MAX_BYTES_PER_DB:
+            latest = {}
+            for e in entries:
+                latest[e["table"]] = e["file"]
+            protected = _with_bases(entries, set(latest.values()))
+            for e in entries:
+                if total <= BACKUP_MAX_BYTES_PER_DB:
+                    break
+                if e["file"] not in keep or e["file"] in protected:
+                    continue
+                # Al quitar una instantánea se van también sus deltas
+                group = {e["file"]} | {d["file"] for d in entries if d.get("base") == e["file"]}
+                if group & protected:
+                    continue
+                group &= keep
+                keep -= group
+                total -= sum(sizes[f] for f in group)
+        removed = [e["file"] for e in entries if e["file"] not in keep]
+        backup_dir = os.path.join(DATA_DIR, db, "backups")
+        for name in removed:
+            try:
+                os.remove(os.path.join(backup_dir, name))
+            except FileNotFoundError:
+                pass
+        if removed:
+            _write_backup_index(db, [e for e in entries if e["file"] in keep])
+    return len(removed)
+
+def compact_all_backups():
+    if not os.path.exists(DATA_DIR):
+        return 0
+    removed = 0
+    for db in os.listdir(DATA_DIR):
+        if os.path.isdir(os.path.join(DATA_DIR, db, "backups")):
+            removed += compact_backups(db)
+    with backup_cond:
+        backup_state["compacted"] += removed
+        backup_state["last_compaction_at"] = time.time()
+    return removed
+
+def _backup_compactor():
+    while True:
+        time.sleep(BACKUP_COMPACT_INTERVAL)
+        try:
+            compact_all_backups()
+        except Exception as e:
+            with backup_cond:
+                backup_state["errors"] += 1
+                backup_state["last_error"] = str(e)
+
+# ==========================
+# MUTACIONES LÓGICAS
+# ==========================
+# INSERT, UPDATE y DELETE se describen como registros lógicos, por ejemplo
+#   {"op": "insert", "rows": [...]}
+#   {"op": "update", "set_col": ..., "set_val": ..., "where_col": ..., "where_val": ...}
+#   {"op": "delete", "where_col": ..., "operator": ..., "where_val": ...}
+#   (con "typed": True los valores ya vienen convertidos al tipo de la columna;
+#    los registros antiguos del WAL, sin esa marca, se comparan como texto)
+#   {"op": "restore", "backup_file": ...}
+#   {"op": "batch", "records": [...]}   (varios registros de una transacción)
+# apply_mutation los aplica sobre una tabla en memoria (lo usan el executor y
+# la recuperación del WAL), y commit_mutation los hace durables.
+
+def compare(val1, op, val2):
+    try:
+        val1 = float(val1)
+        val2 = float(val2)
+    except:
+        pass  # si no son numéricos, se comparan como strings
+    if op == "=":
+        return val1 == val2
+    elif op == ">":
+        return val1 > val2
+    elif op == "<":
+        return val1 < val2
+    elif op == ">=":
+        return val1 >= val2
+    elif op == "<=":
+        return val1 <= val2
+    elif op == "!=":
+        return val1 != val2
+    else:
+        raise ValueError("Operador desconocido")
+
+SQL_OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+}
+
+def typed_matcher(column, op_fn, target):
+    """
+    Condición `columna op valor` de un UPDATE/DELETE tipado, con la misma
+    semántica que el WHERE compilado de un SELECT (column_predicate); NULL no
+    cumple ninguna condición.
+    """
+    if target is None:
+        return lambda row: False
+    predicate = column_predicate(lambda row: row.get(column), op_fn, target)
+    return lambda row: predicate(row) is True
+
+def apply_mutation(table_data, record, positions=None):
+    """
+    Aplica un registro lógico a table_data en memoria. Devuelve las filas
+    afectadas. positions (de index_candidates) limita UPDATE y DELETE a esas
+    filas en lugar de recorrer toda la tabla.
+    """
+    op = record["op"]
+    if op == "insert":
+        table_data["rows"].extend(record["rows"])
+        return len(record["rows"])
+    if op == "update":
+        set_col, set_val = record["set_col"], record["set_val"]
+        where_col, where_val = record["where_col"], record["where_val"]
+        rows = table_data["rows"]
+        updated = 0
+        if record.get("typed", False):
+            matches = typed_matcher(where_col, operator.eq, where_val)
+        else:
+            matches = lambda row: str(row.get(where_col)) == where_val
+        for i in (positions if positions is not None else range(len(rows))):
+            row = rows[i]
+            if matches(row):
+                # Copia de la fila: las filas del buffer pool son compartidas
+                rows[i] = {**row, set_col: set_val}
+                updated += 1
+        return updated
+    if op == "delete":
+        where_col, where_op, where_val = record["where_col"], record["operator"], record["where_val"]
+        before = len(table_data["rows"])
+        if record.get("typed", False) and positions is not None:
+            matches = typed_matcher(where_col, SQL_OPERATORS[where_op], where_val)
+            rows = table_data["rows"]
+            drop = {i for i in positions if matches(rows[i])}
+            if drop:
+                table_data["rows"] = [row for i, row in enumerate(rows) if i not in drop]
+        elif record.get("typed", False):
+            matches = typed_matcher(where_col, SQL_OPERATORS[where_op], where_val)
+            table_data["rows"] = [row for row in table_data["rows"] if not matches(row)]
+        else:
+            table_data["rows"] = [
+                row for row in table_data["rows"]
+                if not compare(row.get(where_col), where_op, where_val)
+            ]
+        return before - len(table_data["rows"])
+    if op == "batch":
+        return sum(apply_mutation(table_data, r) for r in record["records"])
+    if op == "restore":
+        try:
+            backup_data = read_backup(record["db"], record["backup_file"])
+        except FileNotFoundError:
+            return 0
+        table_data["columns"] = backup_data["columns"]
+        # Los respaldos anteriores a los valores tipados se convierten al restaurar
+        table_data["rows"] = coerce_rows_lenient(backup_data["columns"], backup_data["rows"])
+        table_data["typed"] = True
+        return len(table_data["rows"])
+    raise ValueError(f"Mutación desconocida: {op}")
+
+def commit_mutation(db, table, record, create_columns=None, backup=False):
+    """
+    Aplica una mutación lógica de forma durable, con el candado de escritura
+    de la tabla tomado durante toda la secuencia cargar-modificar-guardar:
+    carga la tabla, respalda si se pide, registra en el WAL y guarda. Los
+    INSERT sobre tablas existentes van directo al log de inserciones; si la
+    tabla no existe y se da create_columns, se crea con esas columnas. El
+    registro del WAL se sincroniza (group commit, compartido con los
+    escritores de otras tablas) antes de tocar los archivos de la tabla;
+    como el LSN se asigna con el candado tomado, cada tabla recibe sus
+    mutaciones en orden de LSN y la recuperación sigue siendo correcta.
+    Devuelve el número de filas afectadas.
+    """
+    record = {**record, "db": db, "table": table}
+    with table_write_locked(db, table):
+        table_data = None
+        pending_keys = []
+        if create_columns is not None and not table_exists(db, table):
+            table_data = {"columns": create_columns, "rows": [], "typed": True}
+        elif record["op"] != "insert":
+            table_data = load_table(db, table) or {"columns": [], "rows": []}
+        else:
+            constraints = (load_table_schema(db, table) or {}).get("unique", [])
+            if constraints:
+                pending_keys = check_unique_insert(db, table, constraints, record["rows"])
+        if table_data is not None:
+            # Se aplica antes del WAL para poder rechazar claves repetidas;
+            # las filas son compartidas, así que la caché no se toca
+            before = _table_view(table_data)
+            conditions = record_index_conditions(record) if table_data.get("indexes") else None
+            positions = index_candidates(db, table, table_data, conditions) if conditions else None
+            affected = apply_mutation(table_data, record, positions)
+            if touches_unique(table_data, record):
+                check_unique_rows(table_data)
+            if backup:
+                schedule_backup(db, table, before)
+        lsn = wal_append(record)
+        try:
+            wal_sync(lsn)
+            if table_data is None:
+                log_size = append_rows(db, table, record["rows"], lsn)
+                register_unique_keys(db, table, pending_keys)
+                maybe_compact_table(db, table, log_size)
+                affected = len(record["rows"])
+            else:
+                table_data["lsn"] = lsn
+                save_table(db, table, table_data)
+        finally:
+            wal_done(lsn)
+            result_cache_invalidate(db, table)
+    return affected
+
+# ==========================
+# TRANSACCIONES (BEGIN / COMMIT / ROLLBACK)
+# ==========================
+# Una transacción pertenece a una sesión (campo "session_id" del JSON de
+# /execute; BEGIN genera uno si no viene). Mientras está abierta, INSERT,
+# UPDATE y DELETE solo se aplican a copias en memoria de las tablas tocadas
+# (así los SELECT de la misma sesión ven sus propios cambios) y se guardan
+# como registros lógicos. COMMIT toma los candados de escritura de esas
+# tablas, reaplica los registros sobre su estado actual y hace un solo
+# save_table por tabla, con una única entrada en el WAL para toda la
+# transacción. ROLLBACK descarta todo. Las transacciones sin actividad por
+# más de TRANSACTION_IDLE_TIMEOUT segundos se descartan.
+TRANSACTION_IDLE_TIMEOUT = 600
+
+transactions = {}
+transactions_lock = threading.Lock()
+
+def get_transaction(session_id):
+    """Devuelve la transacción abierta de la sesión, o None."""
+    if not session_id:
+        return None
+    now = time.time()
+    with transactions_lock:
+        for sid in [s for s, t in transactions.items() if now - t["last_used"] > TRANSACTION_IDLE_TIMEOUT]:
+            del transactions[sid]
+        txn = transactions.get(session_id)
+        if txn is not None:
+            txn["last_used"] = now
+        return txn
+
+def begin_transaction(session_id):
+    with transactions_lock:
+        if session_id in transactions:
+            raise ValueError('Ya hay una transacción abierta en esta sesión')
+        transactions[session_id] = {
+            "tables": {},       # (db, tabla) -> copia de trabajo
+            "records": [],      # (db, tabla, registro) en orden
+            "backups": set(),   # tablas que se respaldan al hacer COMMIT
+            "lock": threading.Lock(),
+            "last_used": time.time()
+        }
+
+def rollback_transaction(session_id):
+    with transactions_lock:
+        txn = transactions.pop(session_id, None)
+    if txn is None:
+        raise ValueError('No hay una transacción abierta en esta sesión')
+    return len(txn["records"])
+
+def commit_transaction(session_id):
+    """Aplica todos los registros de la transacción con un save_table por tabla."""
+    with transactions_lock:
+        txn = transactions.pop(session_id, None)
+    if txn is None:
+        raise ValueError('No hay una transacción abierta en esta sesión')
+    if not txn["records"]:
+        return 0
+    changes = OrderedDict()
+    for db, table, record in txn["records"]:
+        changes.setdefault((db, table), []).append(record)
+    # Candados en orden fijo para no bloquearse con otro COMMIT
+    keys = sorted(changes)
+    locks = [table_lock(db, table) for db, table in keys]
+    for lock in locks:
+        lock.acquire_write()
+    try:
+        current = {}
+        for db, table in keys:
+            if not table_exists(db, table):
+                raise ValueError(f'Tabla {table} no existe en base {db}')
+            current[(db, table)] = load_table(db, table)
+            if (db, table) in txn["backups"]:
+                schedule_backup(db, table, current[(db, table)])
+        for key, records in changes.items():
+            table_data = current[key]
+            for record in records:
+                apply_mutation(table_data, record)
+            if any(touches_unique(table_data, record) for record in records):
+                check_unique_rows(table_data)
+        lsn = wal_append({"op": "txn", "changes": [
+            {"db": db, "table": table, "records": records}
+            for (db, table), records in changes.items()
+        ]})
+        try:
+            wal_sync(lsn)
+            for key in changes:
+                table_data = current[key]
+                table_data["lsn"] = lsn
+                save_table(key[0], key[1], table_data)
+                result_cache_invalidate(key[0], key[1])
+        finally:
+            wal_done(lsn)
+    finally:
+        for lock in reversed(locks):
+            lock.release_write()
+    return len(txn["records"])
+
+def read_table(txn, db, table):
+    """Carga una tabla para lectura; dentro de una transacción ve sus cambios."""
+    if txn is not None:
+        with txn["lock"]:
+            working = txn["tables"].get((db, table))
+            if working is not None:
+                return _table_view(working)
+    with tables_read_locked((db, table)):
+        return load_table(db, table)
 
+def write_mutation(txn, db, table, record, backup=False):
+    """Fuera de transacción hace commit_mutation; dentro, la deja pendiente."""
+    if txn is None:
+        return commit_mutation(db, table, record, backup=backup)
+    record = {**record, "db": db, "table": table}
+    with txn["lock"]:
+        working = txn["tables"].get((db, table))
+        if working is None:
+            with tables_read_locked((db, table)):
+                working = load_table(db, table)
+            txn["tables"][(db, table)] = working
+        affected = apply_mutation(working, record)
+        txn["records"].append((db, table, record))
+        if backup:
+            txn["backups"].add((db, table))
+    return affected
+
+# ==========================
+# PREDICADOS (WHERE)
+# ==========================
+# compile_predicate convierte una sola vez el árbol de sqlglot del WHERE en
+# una clausura fila -> True/False/None que se aplica durante el recorrido de
+# la tabla. None es "desconocido" (comparaciones con NULL) y se propaga como
+# en SQL: NOT desconocido sigue siendo desconocido. Los valores se comparan
+# igual que en compare: como números si ambos lados lo son, si no como texto.
+
+COMPARISON_OPERATORS = {
+    exp.EQ: operator.eq,
+    exp.NEQ: operator.ne,
+    exp.GT: operator.gt,
+    exp.GTE: operator.ge,
+    exp.LT: operator.lt,
+    exp.LTE: operator.le,
+}
+# a op b  equivale a  b op' a
+FLIPPED_OPERATORS = {
+    operator.eq: operator.eq,
+    operator.ne: operator.ne,
+    operator.gt: operator.lt,
+    operator.ge: operator.le,
+    operator.lt: operator.gt,
+    operator.le: operator.ge,
+}
+
+def _as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _compile_operand(expr):
+    """Devuelve (getter, constante, es_constante) para un operando del WHERE."""
+    while isinstance(expr, exp.Paren):
+        expr = expr.this
+    if isinstance(expr, exp.Column):
+        name = expr.name
+        return (lambda row: row.get(name)), None, False
+    if isinstance(expr, exp.Null):
+        return None, None, True
+    if isinstance(expr, exp.Boolean):
+        return None, expr.this, True
+    if isinstance(expr, exp.Literal):
+        return None, expr.this, True
+    if isinstance(expr, exp.Neg):
+        _, value, is_const = _compile_operand(expr.this)
+        if is_const and _as_number(value) is not None:
+            return None, "-" + str(value), True
+    raise ValueError(f'Expresión no soportada en WHERE: {expr.sql()}')
+
+def _compare_values(a, op, b):
+    if a is None or b is None:
+        return None
+    num_a, num_b = _as_number(a), _as_number(b)
+    if num_a is not None and num_b is not None:
+        return op(num_a, num_b)
+    return op(str(a), str(b))
+
+def _compile_comparison(op, left, right):
+    left_get, left_const, left_is_const = _compile_operand(left)
+    right_get, right_const, right_is_const = _compile_operand(right)
+    if left_is_const and right_is_const:
+        result = _compare_values(left_const, op, right_const)
+        return lambda row: result
+    if left_is_const:
+        op = FLIPPED_OPERATORS[op]
+        left_get, right_const, right_is_const = right_get, left_const, True
+    if not right_is_const:
+        return lambda row: _compare_values(left_get(row), op, right_get(row))
+    if right_const is None:
+        return lambda row: None
+    return column_predicate(left_get, op, right_const)
+
+def column_predicate(get, op, const):
+    """
+    fila -> bool/None para `columna op constante` (constante no NULL). La
+    constante se convierte una sola vez; también la usan UPDATE y DELETE.
+    """
+    const_num, const_str = _as_number(const), str(const)
+    if const_num is None:
+        def predicate(row):
+            value = get(row)
+            if value is None:
+                return None
+            return op(str(value), const_str)
+        return predicate
+    def predicate(row):
+        value = get(row)
+        if value is None:
+            return None
+        if value.__class__ is not str:
+            # Valores ya tipados (int, float, bool): sin conversión por fila
+            return op(value, const_num)
+        try:
+            return op(float(value), const_num)
+        except ValueError:
+            return op(value, const_str)
+    return predicate
+
+def _like_regex(pattern, flags=0):
+    parts = []
+    for ch in pattern:
+        if ch == "%":
+            parts.append(".*")
+        elif ch == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(ch))
+    return re.compile("".join(parts), re.DOTALL | flags)
+
+def _and_predicates(left, right):
+    def predicate(row):
+        a = left(row)
+        if a is False:
+            return False
+        b = right(row)
+        if b is False:
+            return False
+        return None if a is None or b is None else True
+    return predicate
+
+def compile_predicate(expr):
+    """Compila una expresión WHERE de sqlglot en una función fila -> bool/None."""
+    while isinstance(expr, exp.Paren):
+        expr = expr.this
+    op = COMPARISON_OPERATORS.get(type(expr))
+    if op is not None:
+        return _compile_comparison(op, expr.this, expr.expression)
+    if isinstance(expr, exp.And):
+        return _and_predicates(compile_predicate(expr.this), compile_predicate(expr.expression))
+    if isinstance(expr, exp.Or):
+        left, right = compile_predicate(expr.this), compile_predicate(expr.expression)
+        def predicate(row):
+            a = left(row)
+            if a is True:
+                return True
+            b = right(row)
+            if b is True:
+                return True
+            return None if a is None or b is None else False
+        return predicate
+    if isinstance(expr, exp.Not):
+        inner = compile_predicate(expr.this)
+        def predicate(row):
+            value = inner(row)
+            return None if value is None else not value
+        return predicate
+    if isinstance(expr, exp.Is):
+        if not isinstance(expr.expression, exp.Null):
+            raise ValueError(f'Expresión no soportada en WHERE: {expr.sql()}')
+        getter, const, is_const = _compile_operand(expr.this)
+        if is_const:
+            return lambda row: const is None
+        return lambda row: getter(row) is None
+    if isinstance(expr, exp.Between):
+        low = _compile_comparison(operator.ge, expr.this, expr.args["low"])
+        high = _compile_comparison(operator.le, expr.this, expr.args["high"])
+        return _and_predicates(low, high)
+    if isinstance(expr, exp.In):
+        if expr.args.get("query") or not expr.expressions:
+            raise ValueError(f'Expresión no soportada en WHERE: {expr.sql()}')
+        getter, _, is_const = _compile_operand(expr.this)
+        operands = [_compile_operand(e) for e in expr.expressions]
+        if is_const or not all(o[2] for o in operands):
+            # Lista con columnas: se evalúa como una cadena de OR de igualdades
+            return compile_predicate(exp.or_(*(exp.EQ(this=expr.this, expression=e) for e in expr.expressions)))
+        consts = [o[1] for o in operands if o[1] is not None]
+        as_text = {str(c) for c in consts}
+        as_numbers = {n for n in map(_as_number, consts) if n is not None}
+        def predicate(row):
+            value = getter(row)
+            if value is None:
+                return None
+            if value.__class__ is not str:
+                return value in as_numbers
+            if as_numbers:
+                try:
+                    if float(value) in as_numbers:
+                        return True
+                except ValueError:
+                    pass
+            return value in as_text
+        return predicate
+    if isinstance(expr, (exp.Like, exp.ILike)):
+        getter, _, is_const = _compile_operand(expr.this)
+        _, pattern, pattern_is_const = _compile_operand(expr.expression)
+        if is_const or not pattern_is_const or pattern is None:
+            raise ValueError(f'Expresión no soportada en WHERE: {expr.sql()}')
+        regex = _like_regex(str(pattern), re.IGNORECASE if isinstance(expr, exp.ILike) else 0)
+        def predicate(row):
+            value = getter(row)
+            if value is None:
+                return None
+            return regex.fullmatch(str(value)) is not None
+        return predicate
+    if isinstance(expr, exp.Boolean):
+        return lambda row: expr.this
+    raise ValueError(f'Expresión no soportada en WHERE: {expr.sql()}')
 
 # ==========================
 # CACHE DE RESULTADOS DE CONSULTAS
 # ==========================
-query_cache = {}
+# Resultados de SELECT con llave en la huella de la consulta (el SQL que
+# regenera sqlglot desde el AST, así espacios y mayúsculas no importan) y
+# desalojo LRU por número de entradas y por bytes estimados. Cada entrada
+# recuerda las tablas que leyó; una escritura descarta solo las entradas que
+# dependen de la tabla modificada. Para no guardar un resultado leído antes
+# de una escritura que terminó durante la consulta, cada tabla lleva una
+# generación que sube al invalidar: si cambió entre que empezó la lectura y
+# el guardado, el resultado no se guarda.
+RESULT_CACHE_MAX_ENTRIES = 256
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+result_cache = OrderedDict()     # huella -> {"result", "tables", "bytes"}
+result_cache_deps = {}           # (db, tabla) -> huellas que la leyeron
+result_cache_generations = {}    # (db, tabla) o (db, None) -> generación
+result_cache_lock = threading.Lock()
+result_cache_state = {"bytes": 0, "hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+def query_fingerprint(stmt):
+    """Huella normalizada de una sentencia ya parseada."""
+    return hashlib.sha1(stmt.sql().encode("utf-8")).hexdigest()
+
+def _result_bytes(result):
+    # Estimación con una muestra de filas: serializar todo costaría tanto como la consulta
+    rows = result["rows"]
+    sample = rows[:16]
+    per_row = len(json.dumps(sample, default=str)) / len(sample) if sample else 0
+    return int(per_row * len(rows)) + len(json.dumps(result["columns"])) + 64
+
+def _generation(tables):
+    # Se llama con result_cache_lock tomado; incluye la generación de cada base
+    return tuple(result_cache_generations.get(key, 0)
+                 for db, table in tables for key in ((db, table), (db, None)))
+
+def result_cache_generation(tables):
+    """Generaciones actuales de las tablas; se toman antes de leerlas."""
+    with result_cache_lock:
+        return _generation(tables)
+
+def result_cache_get(fingerprint):
+    with result_cache_lock:
+        entry = result_cache.get(fingerprint)
+        if entry is None:
+            result_cache_state["misses"] += 1
+            return None
+        result_cache.move_to_end(fingerprint)
+        result_cache_state["hits"] += 1
+        return entry["result"]
+
+def result_cache_put(fingerprint, tables, generation, result):
+    """Guarda el resultado si ninguna de sus tablas cambió desde `generation`."""
+    size = _result_bytes(result)
+    if size > RESULT_CACHE_MAX_BYTES:
+        return
+    with result_cache_lock:
+        if _generation(tables) != generation:
+            return
+        _result_cache_discard(fingerprint)
+        result_cache[fingerprint] = {"result": result, "tables": tables, "bytes": size}
+        result_cache_state["bytes"] += size
+        for key in tables:
+            result_cache_deps.setdefault(key, set()).add(fingerprint)
+        while len(result_cache) > RESULT_CACHE_MAX_ENTRIES or result_cache_state["bytes"] > RESULT_CACHE_MAX_BYTES:
+            _result_cache_discard(next(iter(result_cache)))
+            result_cache_state["evictions"] += 1
+
+def result_cache_invalidate(db, table=None):
+    """Descarta los resultados que leyeron la tabla, o cualquier tabla de la base si table es None."""
+    with result_cache_lock:
+        result_cache_generations[(db, table)] = result_cache_generations.get((db, table), 0) + 1
+        for key in [k for k in result_cache_deps if k[0] == db and (table is None or k[1] == table)]:
+            for fingerprint in result_cache_deps.pop(key, ()):
+                if _result_cache_discard(fingerprint):
+                    result_cache_state["invalidations"] += 1
+
+def _result_cache_discard(fingerprint):
+    # Se llama con result_cache_lock tomado
+    entry = result_cache.pop(fingerprint, None)
+    if entry is None:
+        return False
+    result_cache_state["bytes"] -= entry["bytes"]
+    for key in entry["tables"]:
+        deps = result_cache_deps.get(key)
+        if deps is not None:
+            deps.discard(fingerprint)
+            if not deps:
+                del result_cache_deps[key]
+    return True
+
+def result_cache_stats():
+    with result_cache_lock:
+        return {"entries": len(result_cache), **result_cache_state}
+
+# ==========================
+# CACHE DE PLANES (PARSER + ALGEBRIZER)
+# ==========================
+# Guarda el AST y el stmt_info de cada consulta con llave en sus tokens (tipo
+# y texto, sin ';' final), así una consulta repetida se salta el parser y el
+# algebrizer. El tokenizador de sqlglot ya descarta espacios y comentarios y
+# respeta las cadenas: "-- nota\nWHERE k = 1" conserva el WHERE y
+# "-- nota WHERE k = 1" no, así que no comparten plan. Tokenizar cuesta mucho
+# menos que parsear. Las entradas son
+# compartidas entre peticiones: ni el AST ni stmt_info se modifican después
+# de construirse.
+PLAN_CACHE_MAX_ENTRIES = 512
+
+plan_cache = OrderedDict()       # tokens de la consulta -> (stmt, stmt_info)
+plan_cache_lock = threading.Lock()
+plan_cache_state = {"hits": 0, "misses": 0, "evictions": 0}
+
+def plan_cache_key(query):
+    """Tokens (tipo, texto) de la consulta sin ';' final, o None si no se puede tokenizar."""
+    try:
+        tokens = Dialect.get_or_raise(None).tokenize(query)
+    except Exception:
+        # El parser reportará el error de sintaxis
+        return None
+    while tokens and tokens[-1].token_type == TokenType.SEMICOLON:
+        tokens.pop()
+    return tuple((token.token_type, token.text) for token in tokens)
+
+def plan_cache_get(key):
+    with plan_cache_lock:
+        entry = plan_cache.get(key)
+        if entry is None:
+            plan_cache_state["misses"] += 1
+            return None
+        plan_cache.move_to_end(key)
+        plan_cache_state["hits"] += 1
+        return entry
+
+def plan_cache_put(key, stmt, stmt_info):
+    with plan_cache_lock:
+        plan_cache[key] = (stmt, stmt_info)
+        plan_cache.move_to_end(key)
+        while len(plan_cache) > PLAN_CACHE_MAX_ENTRIES:
+            plan_cache.popitem(last=False)
+            plan_cache_state["evictions"] += 1
+
+def plan_cache_stats():
+    with plan_cache_lock:
+        return {"entries": len(plan_cache), **plan_cache_state}
+
+def plan_query(query):
+    """Parser + algebrizer, o el plan ya guardado para los mismos tokens."""
+    key = plan_cache_key(query)
+    cached = plan_cache_get(key) if key is not None else None
+    if cached is not None:
+        return cached
+    stmt = parser(query)
+    stmt_info = algebrizer(stmt)
+    if key is not None:
+        plan_cache_put(key, stmt, stmt_info)
+    return stmt, stmt_info
+
+# ==========================
+# PARÁMETROS (?)
+# ==========================
+# /execute acepta "params": [...] para las consultas con marcadores '?'. El
+# texto con marcadores es siempre el mismo, así que el plan se construye una
+# sola vez (caché de planes) y en cada ejecución solo se enlazan los valores.
+# Los valores nunca se pegan al texto SQL: en un SELECT se ponen como
+# literales en una copia del WHERE y en INSERT/UPDATE/DELETE reemplazan al
+# valor leído del texto antes de la validación de tipos.
+
+def _param_literal(value):
+    if value is None:
+        return exp.Null()
+    if isinstance(value, bool):
+        return exp.Boolean(this=value)
+    if isinstance(value, (int, float)):
+        return exp.Literal.number(value)
+    if isinstance(value, str):
+        return exp.Literal.string(value)
+    raise ValueError(f'Tipo de parámetro no soportado: {type(value).__name__}')
+
+def _check_param_count(expected, params):
+    if expected != len(params):
+        raise ValueError(f'La consulta tiene {expected} parámetros ? y se recibieron {len(params)}')
+
+def bind_params(stmt_info, params):
+    """Copia de stmt_info con los parámetros enlazados en el WHERE del SELECT."""
+    params = list(params or [])
+    _check_param_count(stmt_info["placeholders"], params)
+    if stmt_info["type"] != "SELECT" or not params:
+        return stmt_info
+    # El WHERE del plan es compartido: se enlaza sobre una copia
+    where = stmt_info["where"].copy() if stmt_info["where"] is not None else None
+    # Orden de aparición en el texto (recorrido en profundidad, izquierda a derecha)
+    markers = list(where.find_all(exp.Placeholder, bfs=False)) if where is not None else []
+    if len(markers) != len(params):
+        raise ValueError('En un SELECT los parámetros ? solo se admiten en el WHERE')
+    for marker, value in zip(markers, params):
+        if marker is where:
+            where = _param_literal(value)
+        else:
+            marker.replace(_param_literal(value))
+    fingerprint = hashlib.sha1((stmt_info["fingerprint"] + json.dumps(params)).encode("utf-8")).hexdigest()
+    return {**stmt_info, "where": where, "predicate": compile_predicate(where), "fingerprint": fingerprint}
+
+def bind_param_values(raw_values, params):
+    """Reemplaza cada '?' por el siguiente parámetro; los demás valores se limpian de comillas."""
+    params = list(params or [])
+    _check_param_count(sum(1 for v in raw_values if v.strip() == "?"), params)
+    bound = iter(params)
+    return [next(bound) if v.strip() == "?" else v.strip().strip("'") for v in raw_values]
 
 # ==========================
 # CICLO DE VIDA DE UNA CONSULTA SQL
 # ==========================
 
+def is_statement(stmt):
+    # sqlglot devuelve None para ';' vacíos y exp.Semicolon para un comentario
+    # después de ';' (por ejemplo "SELECT 1; -- nota"): no son sentencias
+    return stmt is not None and not isinstance(stmt, exp.Semicolon)
+
 def parser(query):
     """Etapa 1: Parser - Analiza y valida la sintaxis SQL."""
-    parsed = sqlglot.parse(query)
-    print(parsed[0].dump())
+    # sqlglot no reconoce START TRANSACTION en el dialecto por defecto
+    if re.match(r'^\s*start\s+transaction\s*;?\s*$', query, re.IGNORECASE):
+        query = "BEGIN"
+    parsed = [stmt for stmt in sqlglot.parse(query) if is_statement(stmt)]
     if not parsed or len(parsed) == 0:
         raise ValueError("Consulta SQL vacía o inválida")
+    if len(parsed) > 1:
+        raise ValueError("La consulta tiene varias sentencias; usa /execute_batch para ejecutar un script")
     return parsed[0]
 
+AGGREGATE_FUNCTIONS = {exp.Sum: "SUM", exp.Count: "COUNT", exp.Avg: "AVG", exp.Min: "MIN", exp.Max: "MAX"}
+
+def _aggregate_info(func, alias=None):
+    # COUNT(DISTINCT col) llega como Count(Distinct(col))
+    arg = func.this
+    distinct = isinstance(arg, exp.Distinct)
+    if distinct:
+        arg = arg.expressions[0]
+    return {"func": AGGREGATE_FUNCTIONS[type(func)], "col": str(arg), "alias": alias, "distinct": distinct}
+
+def _limit_value(node, clause):
+    value = _as_number(node.expression.this) if isinstance(node.expression, exp.Literal) else None
+    if value is None or value < 0 or value != int(value):
+        raise ValueError(f'{clause} debe ser un entero no negativo')
+    return int(value)
+
 def algebrizer(stmt):
     """
     Etapa 2: Algebrizer mejorado.
-    Extrae tipo de sentencia, tablas, columnas, joins y group by del AST de sqlglot.
+    Extrae tipo de sentencia, tablas, columnas, joins, group by y where del AST de sqlglot.
     """
     info = {
         "type": stmt.key.upper(),
@@ -128,21 +2903,25 @@ def algebrizer(stmt):
         "columns": [],
         "joins": [],
         "group_by": [],
-        "aggregates": []
+        "aggregates": [],
+        "order_by": [],
+        "limit": None,
+        "offset": 0,
+        "where": None,
+        "predicate": None,
+        "placeholders": sum(1 for _ in stmt.find_all(exp.Placeholder))
     }
     # Tablas principales
     if hasattr(stmt, "args") and "from" in stmt.args and stmt.args["from"]:
         main_table = stmt.args["from"].args["this"]
-        info["tables"].append(str(main_table))
+        # Sin comentarios: sqlglot pega al nodo de la tabla un "-- nota" que la siga
+        info["tables"].append(main_table.sql(comments=False))
     # Columnas seleccionadas y agregaciones
     if hasattr(stmt, "args") and "expressions" in stmt.args and stmt.args["expressions"]:
         for expr in stmt.args["expressions"]:
-            if expr.key.upper() in ("SUM", "COUNT"):
-                info["aggregates"].append({
-                    "func": expr.key.upper(),
-                    "col": str(expr.args["this"]),
-                    "alias": getattr(expr, "alias", None)
-                })
+            func = expr.this if isinstance(expr, exp.Alias) else expr
+            if type(func) in AGGREGATE_FUNCTIONS:
+                info["aggregates"].append(_aggregate_info(func, expr.alias or None))
             else:
                 info["columns"].append(getattr(expr, "alias", None) or getattr(expr, "name", None) or str(expr))
     # Joins
@@ -151,7 +2930,7 @@ def algebrizer(stmt):
             join_table = join.args["this"]
             on_expr = join.args["on"]
             info["joins"].append({
-                "table": str(join_table),
+                "table": join_table.sql(comments=False),
                 "on_left": str(on_expr.args["this"]),
                 "on_right": str(on_expr.args["expression"])
             })
@@ -159,113 +2938,184 @@ def algebrizer(stmt):
     if hasattr(stmt, "args") and "group" in stmt.args and stmt.args["group"]:
         for gexpr in stmt.args["group"].expressions:
             info["group_by"].append(str(gexpr))
+    # Order by: cada clave es una columna de la fila o el alias de una agregación
+    if stmt.args.get("order"):
+        info["order_by"] = []
+        for ordered in stmt.args["order"].expressions:
+            key = ordered.this
+            if type(key) in AGGREGATE_FUNCTIONS:
+                agg = _aggregate_info(key)
+                match = next((a for a in info["aggregates"]
+                              if (a["func"], a["col"], a["distinct"]) == (agg["func"], agg["col"], agg["distinct"])), agg)
+                name = aggregate_alias(match)
+            elif isinstance(key, exp.Column):
+                name = key.name
+            else:
+                raise ValueError(f'ORDER BY solo admite columnas o agregaciones: {key.sql()}')
+            info["order_by"].append({"col": name, "desc": bool(ordered.args.get("desc")),
+                                     "nulls_first": bool(ordered.args.get("nulls_first"))})
+    # Limit / offset
+    if stmt.args.get("limit"):
+        info["limit"] = _limit_value(stmt.args["limit"], "LIMIT")
+    if stmt.args.get("offset"):
+        info["offset"] = _limit_value(stmt.args["offset"], "OFFSET")
+    # Where: se compila una sola vez en un predicado que se aplica en el recorrido
+    if info["type"] == "SELECT" and stmt.args.get("where"):
+        info["where"] = stmt.args["where"].this
+        # Con parámetros ? el predicado se compila al enlazar los valores
+        if not info["placeholders"]:
+            info["predicate"] = compile_predicate(info["where"])
+    # Huella para la caché de resultados; se calcula una vez por plan
+    if info["type"] == "SELECT":
+        info["fingerprint"] = query_fingerprint(stmt)
     return info
 
-def optimizer(stmt_type, query):
+def optimizer(stmt_type, query, in_transaction=False, stmt_info=None):
     """Etapa 3: Optimizer/Planner - Usa caché para SELECT, plan simple para otros."""
-    if stmt_type == "SELECT" and query in query_cache:
-        return {"plan": "cache", "cached_result": query_cache[query]}
+    # Dentro de una transacción la caché no ve los cambios pendientes
+    if stmt_type == "SELECT" and not in_transaction and stmt_info is not None:
+        fingerprint = stmt_info["fingerprint"]
+        cached = result_cache_get(fingerprint)
+        if cached is not None:
+            return {"plan": "cache", "cached_result": cached}
+        return {"plan": "execute", "query": query, "fingerprint": fingerprint}
     return {"plan": "execute", "query": query}
 
+def execute_select(stmt_info, txn=None, lazy=False):
+    """
+    Ejecuta un SELECT ya algebrizado; dentro de una transacción lee sus copias.
+    Con lazy=True las filas sin agregación salen como un iterador que filtra y
+    proyecta a medida que se consume (las filas leídas son inmutables, así que
+    recorrerlas después de soltar el candado es seguro).
+    """
+    # JOIN simple
+    if stmt_info["joins"]:
+        main_table = stmt_info["tables"][0]
+        join = stmt_info["joins"][0]
+        join_table = join["table"]
+        left_col = join["on_left"].split(".")[-1]
+        right_col = join["on_right"].split(".")[-1]
+        db1, t1 = parse_db_table(main_table)
+        db2, t2 = parse_db_table(join_table)
+        if txn is not None:
+            rows1 = read_table(txn, db1, t1)["rows"]
+            rows2 = read_table(txn, db2, t2)["rows"]
+        else:
+            with tables_read_locked((db1, t1), (db2, t2)):
+                rows1 = load_table(db1, t1)["rows"]
+                rows2 = load_table(db2, t2)["rows"]
+        joined = hash_join(rows1, rows2, left_col, right_col)
+        if stmt_info["predicate"] is not None:
+            joined = filter(stmt_info["predicate"], joined)
+
+        # Si hay GROUP BY o agregaciones, se agrega sobre el resultado del JOIN
+        if stmt_info["group_by"] or stmt_info["aggregates"]:
+            columns, result = group_by_agg(joined, stmt_info["group_by"], stmt_info["aggregates"])
+            result = list(order_and_limit(result, stmt_info["order_by"], stmt_info["limit"], stmt_info["offset"]))
+            return {"source": "executed", "columns": columns, "rows": result}
+
+        # Si no hay GROUP BY, solo selecciona columnas del JOIN (ya ordenadas y recortadas)
+        joined = order_and_limit(joined, stmt_info["order_by"], stmt_info["limit"], stmt_info["offset"])
+        columns = stmt_info["columns"]
+        real_cols = [col.split(".", 1)[1] if "." in col else col for col in columns]
+        result = ({col: row.get(real_col) for col, real_col in zip(columns, real_cols)} for row in joined)
+
+        # Y las devuelves
+        return {
+            "source": "executed",
+            "columns": columns,
+            "rows": result if lazy else list(result)
+        }
+
+    # SELECT simple (sin JOIN)
+    if stmt_info["tables"]:
+        db, table = parse_db_table(stmt_info["tables"][0])
+        positions = None
+        order_by = stmt_info["order_by"]
+        aggregated = bool(stmt_info["group_by"] or stmt_info["aggregates"])
+        if txn is None:
+            with tables_read_locked((db, table)):
+                table_data = load_table(db, table)
+                if table_data and table_data.get("indexes"):
+                    conditions = {}
+                    if stmt_info["predicate"] is not None:
+                        conditions = where_index_conditions(stmt_info["where"], table_data["columns"])
+                    if len(order_by) == 1 and not aggregated:
+                        # El índice ya entrega las filas en el orden pedido
+                        positions = index_ordered_positions(db, table, table_data, conditions, order_by[0])
+                        if positions is not None:
+                            order_by = []
+                    if positions is None and conditions:
+                        # Con un índice aplicable solo se revisan las filas candidatas
+                        positions = index_candidates(db, table, table_data, conditions)
+        else:
+            table_data = read_table(txn, db, table)
+        if not table_data:
+            raise ValueError(f'Tabla {table} no existe en base {db}')
+        rows = table_data["rows"]
+        if positions is not None:
+            rows = map(rows.__getitem__, positions)
+        if stmt_info["predicate"] is not None:
+            # Se filtra durante el recorrido: solo se proyectan las filas que cumplen
+            rows = filter(stmt_info["predicate"], rows)
+        if aggregated:
+            # La agregación consume el recorrido sin materializar las filas
+            column_names, result = group_by_agg(rows, stmt_info["group_by"], stmt_info["aggregates"])
+            result = list(order_and_limit(result, order_by, stmt_info["limit"], stmt_info["offset"]))
+            return {"source": "executed", "columns": column_names, "rows": result}
+        # Se ordena y recorta antes de proyectar: ORDER BY puede usar columnas no seleccionadas
+        rows = order_and_limit(rows, order_by, stmt_info["limit"], stmt_info["offset"])
+        if stmt_info["columns"] == ["*"]:
+            # Devuelve todas las columnas
+            result = rows
+            column_names = [col['name'] for col in table_data["columns"]]
+        else:
+            column_names = stmt_info["columns"]
+            result = ({col: row.get(col) for col in column_names} for row in rows)
+        return {"source": "executed", "columns": column_names, "rows": result if lazy else list(result)}
+    raise ValueError('Solo se soportan CREATE TABLE, INSERT, SELECT, UPDATE y DELETE básicos con db.tabla')
+
+def select_tables(stmt_info):
+    """Tablas (db, tabla) que lee un SELECT."""
+    names = stmt_info["tables"] + [join["table"] for join in stmt_info["joins"]]
+    return tuple(parse_db_table(name) for name in names)
+
 def executor(plan, stmt_type, query, data, stmt_info):
     """Etapa 4: Executor - Ejecuta el plan (toda tu lógica real aquí)."""
     # SELECT con caché
     if plan.get("plan") == "cache":
         return {"source": "cache", **plan["cached_result"]}
 
+    session_id = data.get("session_id")
+    txn = get_transaction(session_id)
+
+    # BEGIN / COMMIT / ROLLBACK
+    if stmt_type == "TRANSACTION":
+        if not session_id:
+            session_id = uuid.uuid4().hex
+        begin_transaction(session_id)
+        return {'message': 'Transacción iniciada', 'session_id': session_id}
+    if stmt_type == "COMMIT":
+        count = commit_transaction(session_id)
+        return {'message': f'Transacción confirmada ({count} sentencias aplicadas)'}
+    if stmt_type == "ROLLBACK":
+        count = rollback_transaction(session_id)
+        return {'message': f'Transacción revertida ({count} sentencias descartadas)'}
+    if txn is not None and stmt_type not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        raise ValueError('Dentro de una transacción solo se permiten SELECT, INSERT, UPDATE y DELETE')
+
     # --- Lógica para SELECT usando stmt_info ---
     if stmt_type == "SELECT":
-        # JOIN simple
-        if stmt_info["joins"]:
-            main_table = stmt_info["tables"][0]
-            join = stmt_info["joins"][0]
-            join_table = join["table"]
-            left_col = join["on_left"].split(".")[-1]
-            right_col = join["on_right"].split(".")[-1]
-            db1, t1 = parse_db_table(main_table)
-            db2, t2 = parse_db_table(join_table)
-            rows1 = load_table(db1, t1)["rows"]
-            rows2 = load_table(db2, t2)["rows"]
-            joined = join_tables(rows1, rows2, left_col, right_col)
-
-            # Si hay GROUP BY, agrupa sobre el resultado del JOIN
-            if stmt_info["group_by"]:
-                group_cols = [col for col in stmt_info["group_by"]]
-                result = []
-                groups = {}
-                for row in joined:
-                    key = tuple(row[col.split(".")[-1]] for col in group_cols)
-                    groups.setdefault(key, []).append(row)
-                for key, group_rows in groups.items():
-                    result_row = {col.split(".")[-1]: val for col, val in zip(group_cols, key)}
-                    for agg in stmt_info["aggregates"]:
-                        agg_func = agg["func"]
-                        agg_col = agg["col"].split(".")[-1]
-                        alias = agg["alias"] or f"{agg_func.lower()}_{agg_col}"
-                        if agg_func == "SUM":
-                            agg_value = sum(float(r.get(agg_col, 0)) for r in group_rows)
-                        elif agg_func == "COUNT":
-                            agg_value = len(group_rows)
-                        else:
-                            agg_value = None
-                        result_row[alias] = agg_value
-                    result.append(result_row)
-                    # Inferir columnas a partir de las keys del primer row
-                columns = list(result[0].keys()) if result else []
-
-                return {
-                    "source": "executed",
-                    "columns": columns,
-                    "rows": result
-                }
-
+        fingerprint = plan.get("fingerprint") if txn is None else None
+        if fingerprint is not None:
+            tables = select_tables(stmt_info)
+            generation = result_cache_generation(tables)
+        result = execute_select(stmt_info, txn)
+        if fingerprint is not None:
+            result_cache_put(fingerprint, tables, generation,
+                             {"columns": result["columns"], "rows": result["rows"]})
+        return result
 
-            else:
-                # Si no hay GROUP BY, solo selecciona columnas del JOIN
-                result = []
-                for row in joined:
-                    result_row = {}
-                    for col in stmt_info["columns"]:
-                        if "." in col:
-                            _, real_col = col.split(".", 1)
-                        else:
-                            real_col = col
-                        result_row[col] = row.get(real_col)
-                    for agg in stmt_info["aggregates"]:
-                        alias = agg["alias"] or f"{agg['func'].lower()}_{agg['col']}"
-                        if agg["func"] == "SUM":
-                            result_row[alias] = float(row.get(agg["col"], 0))
-                        elif agg["func"] == "COUNT":
-                            result_row[alias] = 1
-                    result.append(result_row)
-
-                # Aquí infieres las columnas
-                columns = list(result[0].keys()) if result else []
-
-                # Y las devuelves
-                return {
-                    "source": "executed",
-                    "columns": columns,
-                    "rows": result
-                }
-
-
-        # SELECT simple (sin JOIN ni GROUP BY)
-        if stmt_info["tables"]:
-            db, table = parse_db_table(stmt_info["tables"][0])
-            table_data = load_table(db, table)
-            if not table_data:
-                raise ValueError(f'Tabla {table} no existe en base {db}')
-            if stmt_info["columns"] == ["*"]:
-                # Devuelve todas las columnas
-                result = [row for row in table_data["rows"]]
-                column_names = [col['name'] for col in table_data["columns"]]
-            else:
-                result = [{col: row.get(col) for col in stmt_info["columns"]} for row in table_data["rows"]]
-                column_names = stmt_info["columns"]
-            query_cache[query] = {"columns": column_names, "rows": result}
-            return {"source": "executed", "columns": column_names, "rows": result}
-    
     # CREATE DATABASE
     if query.lower().startswith("create database"):
         match = re.match(r"create database (\w+)", query, re.IGNORECASE)
@@ -278,13 +3128,13 @@ def executor(plan, stmt_type, query, data, stmt_info):
         if os.path.exists(db_path):
             raise ValueError(f'La base de datos {db_name} ya existe')
         os.makedirs(db_path, exist_ok=True)
-        query_cache.clear()
+        catalog_add_database(db_name)
+        result_cache_invalidate(db_name)
         return {'message': f'Base de datos {db_name} creada'}
     
     # SHOW DATABASES
     if query.lower().startswith("show databases"):
-        dbs = [d for d in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR, d))]
-        return {'databases': dbs}
+        return {'databases': catalog_list_databases()}
     
     # RENAME DATABASE
     if query.lower().startswith("rename database"):
@@ -296,12 +3146,18 @@ def executor(plan, stmt_type, query, data, stmt_info):
             raise ValueError('Nombre de base de datos inválido')
         old_path = os.path.join(DATA_DIR, old_db)
         new_path = os.path.join(DATA_DIR, new_db)
-        if not os.path.exists(old_path):
-            raise ValueError(f'La base de datos {old_db} no existe')
-        if os.path.exists(new_path):
-            raise ValueError(f'La base de datos {new_db} ya existe')
-        os.rename(old_path, new_path)
-        query_cache.clear()
+        with database_write_locked(old_db):
+            if not os.path.exists(old_path):
+                raise ValueError(f'La base de datos {old_db} no existe')
+            if os.path.exists(new_path):
+                raise ValueError(f'La base de datos {new_db} ya existe')
+            wal_checkpoint()
+            os.rename(old_path, new_path)
+            pool_invalidate(old_db)
+            pool_invalidate(new_db)
+            catalog_rename_database(old_db, new_db)
+        result_cache_invalidate(old_db)
+        result_cache_invalidate(new_db)
         return {'message': f'Base de datos {old_db} renombrada a {new_db}'}
     
     # DROP DATABASE
@@ -312,11 +3168,7 @@ def executor(plan, stmt_type, query, data, stmt_info):
         db_name = match.group(1)
         if not is_valid_name(db_name):
             raise ValueError('Nombre de base de datos inválido')
-        db_path = os.path.join(DATA_DIR, db_name)
-        if not os.path.exists(db_path):
-            raise ValueError(f'La base de datos {db_name} no existe')
-        shutil.rmtree(db_path)
-        query_cache.clear()
+        drop_database_files(db_name)
         return {'message': f'Base de datos {db_name} eliminada'}
 
     # CREATE TABLE
@@ -338,15 +3190,30 @@ def executor(plan, stmt_type, query, data, stmt_info):
             'JSON', 'XML', 'GEOMETRY'
         ]
         columns_list = []
-        for col_def in columns.replace('\n', '').split(','):
+        key_defs = []   # (columnas, es_primaria)
+        # Las comas dentro de paréntesis no separan columnas: DECIMAL(10,2), PRIMARY KEY (a, b)
+        for col_def in re.split(r',(?![^()]*\))', columns.replace('\n', ' ')):
             col_def = col_def.strip().strip(',')
             if not col_def:
                 continue
+            # Restricciones a nivel de tabla: PRIMARY KEY (a, b) / UNIQUE (a, b)
+            key_match = re.match(r'^(primary\s+key|unique)\s*\(([^)]+)\)$', col_def, re.IGNORECASE)
+            if key_match:
+                key_defs.append(([c.strip() for c in key_match.group(2).split(',')],
+                                 key_match.group(1).lower() != 'unique'))
+                continue
             parts = col_def.split()
             if len(parts) < 2:
                 raise ValueError('Cada columna debe tener nombre y tipo, por ejemplo: id INT')
             col_name = parts[0]
             col_type = ' '.join(parts[1:]).upper()
+            # Restricciones a nivel de columna: id INT PRIMARY KEY, email VARCHAR(50) UNIQUE
+            if re.search(r'\sPRIMARY\s+KEY$', col_type):
+                col_type = re.sub(r'\s+PRIMARY\s+KEY$', '', col_type)
+                key_defs.append(([col_name], True))
+            elif re.search(r'\sUNIQUE$', col_type):
+                col_type = re.sub(r'\s+UNIQUE$', '', col_type)
+                key_defs.append(([col_name], False))
             # Permitir tipos con parámetros, como VARCHAR(50)
             base_type = re.match(r'^\w+', col_type)
             if not is_valid_name(col_name):
@@ -356,14 +3223,78 @@ def executor(plan, stmt_type, query, data, stmt_info):
             columns_list.append({"name": col_name, "type": col_type})
         if len(set(col['name'] for col in columns_list)) != len(columns_list):
             raise ValueError('No puede haber columnas repetidas')
-        table_path = os.path.join(DATA_DIR, db, f"{table}.json")
-        if os.path.exists(table_path):
-            raise ValueError(f'La tabla {table} ya existe en base {db}')
-        save_table(db, table, {"columns": columns_list, "rows": []})
-        query_cache.clear()
+        column_names = [col['name'] for col in columns_list]
+        unique_list = []
+        for key_columns, primary in key_defs:
+            for col in key_columns:
+                if col not in column_names:
+                    raise ValueError(f'Columna {col} de la restricción no existe en la tabla {table}')
+            if primary and any(c["primary"] for c in unique_list):
+                raise ValueError('Solo puede haber una PRIMARY KEY por tabla')
+            name = f"pk_{table}" if primary else "uq_" + "_".join(key_columns)
+            if any(c["name"] == name for c in unique_list):
+                raise ValueError(f'Restricción repetida sobre ({", ".join(key_columns)})')
+            unique_list.append({"name": name, "columns": key_columns, "primary": primary})
+        with table_write_locked(db, table):
+            if table_exists(db, table):
+                raise ValueError(f'La tabla {table} ya existe en base {db}')
+            # El LSN actual marca que ningún registro previo del WAL aplica a esta tabla
+            save_table(db, table, {"columns": columns_list, "rows": [], "lsn": wal_current_lsn(), "typed": True,
+                                   "unique": unique_list})
+        result_cache_invalidate(db, table)
         return {'message': f'Tabla {table} creada en base {db} con columnas {columns_list}'}
 
 
+    # CREATE INDEX
+    if query.lower().startswith("create index"):
+        match = re.match(r"create index (\w+) on (\w+\.\w+)\s*\(([^)]+)\)", query, re.IGNORECASE)
+        if not match:
+            raise ValueError('Sintaxis inválida para CREATE INDEX. Usa CREATE INDEX nombre ON db.tabla (col1, col2)')
+        index_name, full_table, index_columns = match.groups()
+        db, table = parse_db_table(full_table)
+        if not db or not is_valid_name(db) or not is_valid_name(table):
+            raise ValueError('Nombre de base de datos o tabla inválido')
+        index_columns = [c.strip() for c in index_columns.split(',')]
+        with table_write_locked(db, table):
+            table_data = load_table(db, table)
+            if not table_data:
+                raise ValueError(f'Tabla {table} no existe en base {db}')
+            column_names = [col["name"] for col in table_data["columns"]]
+            for col in index_columns:
+                if col not in column_names:
+                    raise ValueError(f'Columna {col} no existe en la tabla {table}')
+            if len(set(index_columns)) != len(index_columns):
+                raise ValueError('No puede haber columnas repetidas en el índice')
+            if any(idx["name"] == index_name for idx in table_data.get("indexes", [])):
+                raise ValueError(f'El índice {index_name} ya existe en la tabla {table}')
+            table_data["indexes"] = table_data.get("indexes", []) + [{"name": index_name, "columns": index_columns}]
+            # save_table escribe el header con el índice y construye el archivo .idx
+            save_table(db, table, table_data)
+        result_cache_invalidate(db, table)
+        return {'message': f'Índice {index_name} creado en {table} de {db}'}
+
+    # DROP INDEX
+    if query.lower().startswith("drop index"):
+        match = re.match(r"drop index (\w+)\.(\w+)\.(\w+)", query, re.IGNORECASE)
+        if not match:
+            raise ValueError('Sintaxis inválida para DROP INDEX. Usa DROP INDEX db.tabla.nombre')
+        db, table, index_name = match.groups()
+        with table_write_locked(db, table):
+            table_data = load_table(db, table)
+            if not table_data:
+                raise ValueError(f'Tabla {table} no existe en base {db}')
+            indexes = table_data.get("indexes", [])
+            if not any(idx["name"] == index_name for idx in indexes):
+                raise ValueError(f'El índice {index_name} no existe en la tabla {table}')
+            table_data["indexes"] = [idx for idx in indexes if idx["name"] != index_name]
+            save_table(db, table, table_data)
+            # El índice ya salió del header: si falta el archivo no es un error
+            with suppress(FileNotFoundError):
+                os.remove(index_file(db, table, index_name))
+            index_invalidate(db, table)
+        result_cache_invalidate(db, table)
+        return {'message': f'Índice {index_name} eliminado de {table} en {db}'}
+
     # DROP TABLE
     if query.lower().startswith("drop table"):
         match = re.match(r"drop table (\w+\.\w+)", query, re.IGNORECASE)
@@ -373,11 +3304,11 @@ def executor(plan, stmt_type, query, data, stmt_info):
         db, table = parse_db_table(full_table)
         if not db or not is_valid_name(db) or not is_valid_name(table):
             raise ValueError('Nombre de base de datos o tabla inválido')
-        table_path = os.path.join(DATA_DIR, db, f"{table}.json")
-        if not os.path.exists(table_path):
-            raise ValueError(f'La tabla {table} no existe en base {db}')
-        os.remove(table_path)
-        query_cache.clear()
+        with table_write_locked(db, table):
+            if not table_exists(db, table):
+                raise ValueError(f'La tabla {table} no existe en base {db}')
+            drop_table_files(db, table)
+        result_cache_invalidate(db, table)
         return {'message': f'Tabla {table} eliminada de la base {db}'}
 
     # RENAME TABLE
@@ -390,14 +3321,16 @@ def executor(plan, stmt_type, query, data, stmt_info):
         db_new, table_new = parse_db_table(full_new)
         if not db or not db_new or db != db_new or not is_valid_name(table_new):
             raise ValueError('Ambas tablas deben estar en la misma base de datos y tener nombres válidos')
-        old_path = os.path.join(DATA_DIR, db, f"{table}.json")
-        new_path = os.path.join(DATA_DIR, db, f"{table_new}.json")
-        if not os.path.exists(old_path):
-            raise ValueError(f'La tabla {table} no existe en base {db}')
-        if os.path.exists(new_path):
-            raise ValueError(f'La tabla {table_new} ya existe en base {db}')
-        os.rename(old_path, new_path)
-        query_cache.clear()
+        # Origen y destino: dos RENAME hacia el mismo nombre no pueden cruzarse
+        with tables_write_locked((db, table), (db, table_new)):
+            if not table_exists(db, table):
+                raise ValueError(f'La tabla {table} no existe en base {db}')
+            if table_exists(db, table_new):
+                raise ValueError(f'La tabla {table_new} ya existe en base {db}')
+            wal_checkpoint()
+            rename_table_files(db, table, table_new)
+        result_cache_invalidate(db, table)
+        result_cache_invalidate(db, table_new)
         return {'message': f'Tabla {table} renombrada a {table_new} en base {db}'}
 
     # INSERT
@@ -410,50 +3343,18 @@ def executor(plan, stmt_type, query, data, stmt_info):
         if not db or not is_valid_name(db) or not is_valid_name(table):
             raise ValueError('Nombre de base de datos o tabla inválido')
         columns = [c.strip() for c in columns.split(',')]
-        values = [v.strip().strip("'") for v in values.split(',')]
-        table_data = load_table(db, table)
+        values = bind_param_values(values.split(','), data.get("params"))
+        # Solo se necesita el esquema: la fila va al log de inserciones
+        table_data = load_table_schema(db, table)
         if not table_data:
             raise ValueError(f'Tabla {table} no existe en base {db}')
         # Validar columnas
         table_columns = [col['name'] for col in table_data["columns"]]
-        print(f"columns: {columns}")
-        print(f"table_columns: {table_columns}")
         if set(columns) != set(table_columns):
             raise ValueError('Debes insertar todas las columnas de la tabla y en el mismo orden')
-        # Validar tipos
-        for i, col in enumerate(table_data["columns"]):
-            col_name = col["name"]
-            col_type = col["type"].upper()
-            val = values[i]
-            base_type = re.match(r'^([A-Z]+)', col_type).group(1)
-            if base_type in ['INT', 'BIGINT']:
-                if not re.match(r'^-?\d+$', val):
-                    raise ValueError(f'El valor para {col_name} debe ser un entero')
-            elif base_type in ['DECIMAL', 'FLOAT', 'NUMERIC']:
-                if not re.match(r'^-?\d+(\.\d+)?$', val):
-                    raise ValueError(f'El valor para {col_name} debe ser numérico')
-            elif base_type in ['BIT']:
-                if val not in ['0', '1', 'True', 'False', 'true', 'false']:
-                    raise ValueError(f'El valor para {col_name} debe ser booleano (0/1 o True/False)')
-            elif base_type in ['DATE', 'DATETIME', 'TIMESTAMP']:
-                try:
-                    datetime.datetime.fromisoformat(val)
-                except Exception:
-                    raise ValueError(f'El valor para {col_name} debe ser una fecha válida (YYYY-MM-DD o similar)')
-            elif base_type in ['VARCHAR', 'CHAR', 'NVARCHAR']:
-                # Extraer longitud si existe, por ejemplo VARCHAR(20)
-                length_match = re.search(r'\((\d+)\)', col_type)
-                if length_match:
-                    max_len = int(length_match.group(1))
-                    if len(val) > max_len:
-                        raise ValueError(f'El valor para {col_name} excede la longitud máxima de {max_len} caracteres')
-                if base_type == 'CHAR' and length_match:
-                    if len(val) != max_len:
-                        raise ValueError(f'El valor para {col_name} debe tener exactamente {max_len} caracteres')
-        row = dict(zip(columns, values))
-        table_data["rows"].append(row)
-        save_table(db, table, table_data)
-        query_cache.clear()
+        # Validar tipos y convertir cada valor al tipo declarado
+        row = coerce_row(table_data["columns"], dict(zip(columns, values)))
+        write_mutation(txn, db, table, {"op": "insert", "rows": [row]})
         return {'message': f'Dato insertado en {table} de {db}', 'row': row}
 
 
@@ -466,26 +3367,24 @@ def executor(plan, stmt_type, query, data, stmt_info):
         db, table = parse_db_table(full_table)
         if not db or not is_valid_name(db) or not is_valid_name(table):
             raise ValueError('Nombre de base de datos o tabla inválido')
-        table_data = load_table(db, table)
+        table_data = load_table_schema(db, table)
         if not table_data:
             raise ValueError(f'Tabla {table} no existe en base {db}')
-        backup_table(db, table, table_data)
         set_col, set_val = [x.strip() for x in set_part.split('=')]
         where_col, where_val = [x.strip() for x in where_part.split('=')]
-        set_val = set_val.strip("'")
-        where_val = where_val.strip("'")
+        set_val, where_val = bind_param_values([set_val, where_val], data.get("params"))
         column_names = [col["name"] for col in table_data["columns"]]
         if set_col not in column_names:
             raise ValueError(f'Columna {set_col} no existe en la tabla {table}')
         if where_col not in column_names:
             raise ValueError(f'Columna {where_col} no existe en la tabla {table}')
-        updated = 0
-        for row in table_data["rows"]:
-            if str(row.get(where_col)) == where_val:
-                row[set_col] = set_val
-                updated += 1
-        save_table(db, table, table_data)
-        query_cache.clear()
+        columns_by_name = {col["name"]: col for col in table_data["columns"]}
+        updated = write_mutation(txn, db, table, {
+            "op": "update",
+            "set_col": set_col, "set_val": coerce_value(columns_by_name[set_col], set_val),
+            "where_col": where_col, "where_val": coerce_value(columns_by_name[where_col], where_val),
+            "typed": True
+        }, backup=True)
         return {'message': f'{updated} filas actualizadas en {table} de {db}'}
 
     # DELETE
@@ -493,56 +3392,269 @@ def executor(plan, stmt_type, query, data, stmt_info):
         match = re.match(r"delete from (\w+\.\w+|\w+) where (\w+)\s*(=|<|>|<=|>=|!=)\s*(.+)", query, re.IGNORECASE)
         if not match:
             raise ValueError('Sintaxis inválida para DELETE')
-        full_table, where_col, operator, where_val = match.groups()
+        full_table, where_col, where_op, where_val = match.groups()
         db, table = parse_db_table(full_table)
         if not db or not is_valid_name(db) or not is_valid_name(table):
             raise ValueError('Nombre de base de datos o tabla inválido')
-        table_data = load_table(db, table)
+        table_data = load_table_schema(db, table)
         if not table_data:
             raise ValueError(f'Tabla {table} no existe en base {db}')
-        backup_table(db, table, table_data)
-        where_val = where_val.strip("'")
+        where_val, = bind_param_values([where_val], data.get("params"))
         column_names = [col["name"] for col in table_data["columns"]]
         if where_col not in column_names:
             raise ValueError(f'Columna {where_col} no existe en la tabla {table}')
 
-        def compare(val1, op, val2):
-            try:
-                val1 = float(val1)
-                val2 = float(val2)
-            except:
-                pass  # si no son numéricos, se comparan como strings
-            if op == "=":
-                return val1 == val2
-            elif op == ">":
-                return val1 > val2
-            elif op == "<":
-                return val1 < val2
-            elif op == ">=":
-                return val1 >= val2
-            elif op == "<=":
-                return val1 <= val2
-            elif op == "!=":
-                return val1 != val2
-            else:
-                raise ValueError("Operador desconocido")
-
-        before = len(table_data["rows"])
-        table_data["rows"] = [
-            row for row in table_data["rows"]
-            if not compare(row.get(where_col), operator, where_val)
-        ]
-        deleted = before - len(table_data["rows"])
-        save_table(db, table, table_data)
-        query_cache.clear()
+        where_column = next(col for col in table_data["columns"] if col["name"] == where_col)
+        deleted = write_mutation(txn, db, table, {
+            "op": "delete",
+            "where_col": where_col, "operator": where_op,
+            "where_val": coerce_value(where_column, where_val),
+            "typed": True
+        }, backup=True)
         return {'message': f'{deleted} filas eliminadas de {table} en {db}'}
 
 
     raise ValueError('Solo se soportan CREATE TABLE, INSERT, SELECT, UPDATE y DELETE básicos con db.tabla')
 
+# ==========================
+# RESPUESTA EN STREAMING (NDJSON)
+# ==========================
+# Con "stream": true en el JSON de /execute (o Accept: application/x-ndjson)
+# un SELECT responde con una línea JSON por registro a medida que el
+# executor produce las filas, en lugar de armar toda la lista y serializarla
+# de una vez. La primera línea trae las columnas, luego viene una línea por
+# fila y al final un registro "trailer" con el tiempo de ejecución y el total
+# de filas (o el error, si el recorrido falla a mitad de camino). Los
+# resultados en streaming no se guardan en la caché de resultados, pero un
+# acierto de la caché sí se envía en streaming.
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_CHUNK_ROWS = 500
+
+def wants_stream(data):
+    return bool(data.get("stream")) or NDJSON_MIMETYPE in request.headers.get("Accept", "")
+
+def stream_select(plan, stmt_info, txn, started, result_format=None):
+    if plan.get("plan") == "cache":
+        result = {"source": "cache", **plan["cached_result"]}
+    else:
+        result = execute_select(stmt_info, txn, lazy=True)
+    # En streaming el formato columnar no aplica: se envían filas compactas
+    as_values = row_values(result["columns"]) if result_format in ("compact", "columnar") else None
+
+    def generate():
+        yield json.dumps({"columns": result["columns"], "source": result["source"]}) + "\n"
+        count = 0
+        chunk = []
+        try:
+            for row in result["rows"]:
+                chunk.append(json.dumps(as_values(row) if as_values else row))
+                if len(chunk) >= STREAM_CHUNK_ROWS:
+                    count += len(chunk)
+                    yield "\n".join(chunk) + "\n"
+                    chunk = []
+        except Exception as e:
+            yield json.dumps({"trailer": {"error": str(e), "rows_affected": count}}) + "\n"
+            return
+        if chunk:
+            count += len(chunk)
+            yield "\n".join(chunk) + "\n"
+        yield json.dumps({"trailer": {"execution_time": time.time() - started, "rows_affected": count}}) + "\n"
+
+    return app.response_class(generate(), mimetype=NDJSON_MIMETYPE)
+
+# ==========================
+# FORMATO COMPACTO Y COMPRESIÓN DE RESPUESTAS
+# ==========================
+# Por defecto las filas van como objetos (el nombre de cada columna se
+# repite en cada fila). Con "format" en el JSON de /execute:
+#   "compact":  "rows" es una lista de arreglos en el orden de "columns"
+#   "columnar": "data" trae un arreglo por columna, en el orden de "columns"
+# Además, las respuestas de más de COMPRESS_MIN_BYTES se comprimen con gzip o
+# deflate según Accept-Encoding; las respuestas en streaming se comprimen por
+# bloques, sin esperar al final.
+RESULT_FORMATS = ("rows", "compact", "columnar")
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+def result_format(data):
+    fmt = data.get("format") or "rows"
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f'Formato de resultado no soportado: {fmt} (usa {", ".join(RESULT_FORMATS)})')
+    return fmt
+
+def row_values(columns):
+    """Función que convierte una fila (dict) en la lista de sus valores en el orden de columns."""
+    return lambda row: [row.get(col) for col in columns]
+
+def apply_result_format(result, fmt):
+    if fmt == "rows" or not isinstance(result.get("rows"), list) or "columns" not in result:
+        return result
+    columns = result["columns"]
+    if fmt == "compact":
+        result["rows"] = list(map(row_values(columns), result.pop("rows")))
+    else:
+        rows = result.pop("rows")
+        result["data"] = [[row.get(col) for row in rows] for col in columns]
+    result["format"] = fmt
+    return result
+
+def negotiate_encoding(accept_encoding):
+    """gzip o deflate según Accept-Encoding (respetando q=0), o None."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            # Un q mal formado (por ejemplo "q=.") cuenta como q=0: una cabecera
+            # inválida del cliente no puede tumbar la respuesta
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ("gzip", "deflate"):
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def _compressor(encoding):
+    # gzip: wbits 31 (cabecera gzip); deflate en HTTP es el formato zlib (wbits 15)
+    return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+
+def _compress_stream(chunks, encoding):
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        # Cada bloque se envía completo para que el cliente pueda ir mostrando filas
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.after_request
+def compress_response(response):
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    if (encoding is None or not 200 <= response.status_code < 300 or response.direct_passthrough
+            or "Content-Encoding" in response.headers):
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        compressor = _compressor(encoding)
+        response.set_data(compressor.compress(body) + compressor.flush())
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+# ==========================
+# CURSORES DEL SERVIDOR
+# ==========================
+# Con "page_size" en el JSON de /execute, un SELECT abre un cursor: responde
+# con la primera página y un "cursor_id", y /fetch entrega las siguientes.
+# El cursor guarda el iterador perezoso del executor sobre la lista de filas
+# leída al abrirlo; como las filas nunca se modifican en sitio, es una foto
+# consistente de la tabla aunque después lleguen escrituras. Los cursores se
+# cierran al agotarse, con /close_cursor, o tras CURSOR_IDLE_TIMEOUT segundos
+# sin uso. Para páginas profundas conviene la paginación por llave
+# (WHERE id > último ORDER BY id LIMIT n): con un índice sobre la llave el
+# executor recorre el índice en orden y se detiene en LIMIT.
+CURSOR_IDLE_TIMEOUT = 300
+MAX_CURSORS = 256
+MAX_PAGE_SIZE = 10000
+
+cursors = OrderedDict()
+cursors_lock = threading.Lock()
+
+def _page_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('page_size debe ser un entero positivo')
+    if size <= 0:
+        raise ValueError('page_size debe ser un entero positivo')
+    return min(size, MAX_PAGE_SIZE)
+
+def _expire_cursors(now):
+    # Se llama con cursors_lock tomado
+    for cid in [c for c, cur in cursors.items() if now - cur["last_used"] > CURSOR_IDLE_TIMEOUT]:
+        del cursors[cid]
+
+def open_cursor(result, page_size, fmt):
+    """Registra un cursor sobre el resultado y devuelve su primera página."""
+    cursor = {
+        "id": uuid.uuid4().hex,
+        "columns": result["columns"],
+        "source": result["source"],
+        "rows": iter(result["rows"]),
+        "pending": [],
+        "page_size": page_size,
+        "format": fmt,
+        "fetched": 0,
+        "last_used": time.time(),
+        "lock": threading.Lock()
+    }
+    with cursors_lock:
+        _expire_cursors(cursor["last_used"])
+        cursors[cursor["id"]] = cursor
+        while len(cursors) > MAX_CURSORS:
+            cursors.popitem(last=False)
+    return fetch_cursor(cursor["id"])
+
+def fetch_cursor(cursor_id, page_size=None):
+    """Siguiente página del cursor, o None si no existe o expiró."""
+    now = time.time()
+    with cursors_lock:
+        _expire_cursors(now)
+        cursor = cursors.get(cursor_id)
+        if cursor is None:
+            return None
+        cursor["last_used"] = now
+        cursors.move_to_end(cursor_id)
+    size = page_size or cursor["page_size"]
+    with cursor["lock"]:
+        # Se lee una fila de más para saber si quedan páginas
+        page = cursor["pending"] + list(islice(cursor["rows"], size + 1 - len(cursor["pending"])))
+        cursor["pending"] = page[size:]
+        page = page[:size]
+        cursor["fetched"] += len(page)
+        has_more = bool(cursor["pending"])
+    if not has_more:
+        close_cursor(cursor_id)
+    result = {
+        "cursor_id": cursor_id if has_more else None,
+        "columns": cursor["columns"],
+        "rows": page,
+        "has_more": has_more,
+        "source": cursor["source"],
+        "fetched": cursor["fetched"],
+        "rows_affected": len(page)
+    }
+    return apply_result_format(result, cursor["format"])
+
+def close_cursor(cursor_id):
+    with cursors_lock:
+        return cursors.pop(cursor_id, None) is not None
+
 # ==========================
 # ENDPOINT PRINCIPAL: EJECUCIÓN DE SQL (modularizado)
 # ==========================
+SUPPORTED_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'CREATE', 'DROP', 'COMMAND',
+                        'TRANSACTION', 'COMMIT', 'ROLLBACK')
+
+def set_rows_affected(result):
+    """Filas devueltas por un SELECT o, en escrituras, las que indica el mensaje."""
+    if "rows" in result and isinstance(result["rows"], list):
+        result["rows_affected"] = len(result["rows"])
+    elif "message" in result and "filas" in result["message"]:
+        match = re.search(r'(\d+)\s+filas?', result["message"])
+        if match:
+            result["rows_affected"] = int(match.group(1))
+    result["rows_affected"] = result.get("rows_affected") or 0
+    return result["rows_affected"]
 
 @app.route('/execute', methods=['POST'])
 def execute_sql():
@@ -554,40 +3666,233 @@ def execute_sql():
     query = data.get('query', '').strip()
     try:
         tiempo_inicio = time.time() # TIEMPO INICIO
-        # 1. Parser
-        stmt = parser(query)
-        # 2. Algebrizer
-        stmt_info = algebrizer(stmt)
+        # 1. Parser y 2. Algebrizer (con caché de planes)
+        stmt, stmt_info = plan_query(query)
+        fmt = result_format(data)
+        if stmt_info["placeholders"] or data.get("params"):
+            stmt_info = bind_params(stmt_info, data.get("params"))
         stmt_type = stmt_info["type"]
-        if stmt_type not in ['SELECT', 'INSERT', 'UPDATE', 'DELETE', 'CREATE', 'DROP', 'COMMAND']:
+        if stmt_type not in SUPPORTED_STATEMENTS:
             return jsonify({'error': f'Tipo de consulta no soportado: {stmt_type}'}), 400
         # 3. Optimizer/Planner (incluye caché)
-        plan = optimizer(stmt_type, query)
+        plan = optimizer(stmt_type, query, get_transaction(data.get("session_id")) is not None, stmt_info)
+        # Cursor del servidor: primera página y cursor_id para /fetch
+        if stmt_type == "SELECT" and data.get("page_size") is not None:
+            page_size = _page_size(data.get("page_size"))
+            txn = get_transaction(data.get("session_id"))
+            if plan.get("plan") == "cache":
+                result = {"source": "cache", **plan["cached_result"]}
+            else:
+                # Dentro de una transacción la copia de trabajo puede cambiar: se materializa
+                result = execute_select(stmt_info, txn, lazy=txn is None)
+            page = open_cursor(result, page_size, fmt)
+            page["execution_time"] = time.time() - tiempo_inicio
+            return jsonify(page)
+        # Respuesta en streaming (NDJSON) para SELECT si el cliente la pide
+        if stmt_type == "SELECT" and wants_stream(data):
+            return stream_select(plan, stmt_info, get_transaction(data.get("session_id")), tiempo_inicio, fmt)
         # 4. Executor
         result = executor(plan, stmt_type, query, data, stmt_info)
         tiempo_ejecucion = time.time()-tiempo_inicio
-        print("Data:", result)
         result['execution_time'] = tiempo_ejecucion # TIEMPO DE EJECUCIÓN
 
         # FILAS AFECTADAS
-        if "rows" in result and isinstance(result["rows"], list):
-            result["rows_affected"] = len(result["rows"])
-        elif "message" in result and "filas" in result["message"]:
-            import re
-            match = re.search(r'(\d+)\s+filas?', result["message"])
-            if match:
-                result["rows_affected"] = int(match.group(1))
-        filas_afectadas = result.get("rows_affected", 0)
-        if filas_afectadas is None:
-            filas_afectadas = 0
-
-        result["rows_affected"] = filas_afectadas = result.get("rows_affected", 0)
-        print(f"Consulta ejecutada en {tiempo_ejecucion:.4f} segundos") # IMPRIMIR TIEMPO DE EJECUCIÓN
-        print(f"{filas_afectadas}") # IMPRIMIR FILAS AFECTADAS
+        filas_afectadas = set_rows_affected(result)
+        apply_result_format(result, fmt)
+        # Solo el tiempo y el conteo: el resultado completo no se escribe al log
+        app.logger.debug("Consulta ejecutada en %.4f segundos (%d filas)", tiempo_ejecucion, filas_afectadas)
 
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
+
+@app.route('/fetch', methods=['POST'])
+def fetch():
+    """Siguiente página de un cursor abierto con page_size en /execute."""
+    data = request.json or {}
+    try:
+        tiempo_inicio = time.time()
+        page_size = _page_size(data["page_size"]) if data.get("page_size") is not None else None
+        page = fetch_cursor(data.get("cursor_id"), page_size)
+        if page is None:
+            return jsonify({'error': 'Cursor no encontrado o expirado'}), 404
+        page["execution_time"] = time.time() - tiempo_inicio
+        return jsonify(page)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/close_cursor', methods=['POST'])
+def close_cursor_endpoint():
+    """Cierra un cursor antes de agotarlo."""
+    data = request.json or {}
+    if not close_cursor(data.get("cursor_id")):
+        return jsonify({'error': 'Cursor no encontrado o expirado'}), 404
+    return jsonify({'message': 'Cursor cerrado'})
+
+# ==========================
+# EJECUCIÓN POR LOTES (SCRIPTS)
+# ==========================
+# /execute_batch recibe un script con varias sentencias separadas por ';'.
+# Se tokeniza y se parsea una sola vez (lo mismo que hace sqlglot.parse, pero
+# conservando los tokens para recortar el texto de cada sentencia, que el
+# executor necesita). Las sentencias se ejecutan en orden. Las escrituras
+# consecutivas (INSERT/UPDATE/DELETE) sobre la misma tabla se agrupan en una
+# transacción interna: la tabla se carga una vez, cada sentencia se aplica a
+# la copia de trabajo y el grupo se guarda con un solo save_table y una sola
+# entrada del WAL. Si el COMMIT del grupo falla (por ejemplo, una clave
+# repetida), el grupo se vuelve a ejecutar sentencia por sentencia para
+# saber cuál falló. Dentro de una transacción abierta por el cliente no se
+# agrupa: las escrituras ya quedan pendientes hasta su COMMIT.
+BATCH_WRITE_TYPES = ("INSERT", "UPDATE", "DELETE")
+
+def split_script(script):
+    """Lista de (texto, sentencia) del script, con un solo parseo."""
+    dialect = Dialect.get_or_raise(None)
+    tokens = dialect.tokenize(script)
+    chunks = [[]]
+    for token in tokens:
+        if token.token_type == TokenType.SEMICOLON:
+            chunks.append([])
+        else:
+            chunks[-1].append(token)
+    chunks = [chunk for chunk in chunks if chunk]
+    if not chunks:
+        return []
+    statements = [stmt for stmt in dialect.parser().parse(tokens, script) if is_statement(stmt)]
+    if len(statements) != len(chunks):
+        raise ValueError('No se pudo separar el script en sentencias')
+    return [(script[chunk[0].start:chunk[-1].end + 1], stmt)
+            for chunk, stmt in zip(chunks, statements)]
+
+def _batch_write_table(stmt_info, stmt):
+    # (db, tabla) de una escritura agrupable, o None
+    if stmt_info["type"] not in BATCH_WRITE_TYPES:
+        return None
+    table = stmt.find(exp.Table)
+    if table is None or not table.db:
+        return None
+    return (table.db, table.name)
+
+def plan_statement(query, stmt):
+    """(stmt, stmt_info) de una sentencia ya parseada del script."""
+    if re.match(r'^\s*start\s+transaction\s*$', query, re.IGNORECASE):
+        return plan_query(query)
+    return stmt, algebrizer(stmt)
+
+def run_statement(query, stmt_info, data):
+    """Optimizer y executor de una sentencia ya planeada; devuelve el resultado."""
+    if stmt_info["type"] not in SUPPORTED_STATEMENTS:
+        raise ValueError(f'Tipo de consulta no soportado: {stmt_info["type"]}')
+    plan = optimizer(stmt_info["type"], query, get_transaction(data.get("session_id")) is not None, stmt_info)
+    result = executor(plan, stmt_info["type"], query, data, stmt_info)
+    set_rows_affected(result)
+    return result
+
+def execute_script(script, data, stop_on_error=True):
+    """Ejecuta las sentencias del script en orden; devuelve (resultados, grupos, omitidas)."""
+    statements = split_script(script)
+    if not statements:
+        raise ValueError("Script SQL vacío")
+    data = dict(data)
+    results = []
+    groups = []
+    group = None    # {"table", "session_id", "indexes"} del grupo de escrituras abierto
+    planned = []    # (texto, stmt_info, error del algebrizer) de cada sentencia, una sola vez
+
+    def run(index, run_data):
+        query, stmt_info, error = planned[index]
+        started = time.time()
+        try:
+            if error is not None:
+                raise error
+            result = run_statement(query, stmt_info, run_data)
+        except Exception as e:
+            result = {"error": str(e)}
+        result["index"] = index
+        result["query"] = query
+        result["execution_time"] = time.time() - started
+        return result
+
+    def flush():
+        # Confirma el grupo abierto; si falla, lo repite sentencia por sentencia
+        nonlocal group
+        if group is None:
+            return True
+        current, group = group, None
+        if not current["indexes"]:
+            rollback_transaction(current["session_id"])
+            return True
+        started = time.time()
+        try:
+            commit_transaction(current["session_id"])
+        except ValueError:
+            # commit_transaction ya descartó la transacción: nada quedó aplicado
+            for i in current["indexes"]:
+                results[i] = run(i, data)
+                if "error" in results[i] and stop_on_error:
+                    del results[i + 1:]
+                    return False
+            return True
+        groups.append({"table": ".".join(current["table"]), "statements": len(current["indexes"]),
+                       "commit_time": time.time() - started})
+        return True
+
+    for index, (query, stmt) in enumerate(statements):
+        stmt_info, error = None, None
+        try:
+            stmt, stmt_info = plan_statement(query, stmt)
+        except Exception as e:
+            error = e
+        planned.append((query, stmt_info, error))
+        table = None
+        if stmt_info is not None and get_transaction(data.get("session_id")) is None:
+            table = _batch_write_table(stmt_info, stmt)
+        if group is not None and group["table"] != table:
+            if not flush():
+                break
+        if table is not None:
+            if group is None:
+                group = {"table": table, "session_id": f"batch-{uuid.uuid4().hex}", "indexes": []}
+                begin_transaction(group["session_id"])
+            result = run(index, {**data, "session_id": group["session_id"]})
+            if "error" not in result:
+                group["indexes"].append(index)
+        else:
+            result = run(index, data)
+            # BEGIN sin session_id genera uno: las siguientes sentencias lo usan
+            if result.get("session_id"):
+                data["session_id"] = result["session_id"]
+        results.append(result)
+        if "error" in result and stop_on_error:
+            break
+    # Al final (o si un error detuvo el script) se confirma lo que ya se aplicó
+    flush()
+    return results, groups, len(statements) - len(results)
+
+@app.route('/execute_batch', methods=['POST'])
+def execute_batch():
+    """
+    Ejecuta un script SQL ("script", sentencias separadas por ';') y devuelve
+    el resultado y el tiempo de cada sentencia. Con "stop_on_error": false
+    sigue después de una sentencia fallida.
+    """
+    data = request.json or {}
+    script = data.get('script') or data.get('query') or ''
+    tiempo_inicio = time.time()
+    try:
+        results, groups, skipped = execute_script(script, data, data.get('stop_on_error', True))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'results': results,
+        'statements': len(results) + skipped,
+        'errors': sum(1 for r in results if "error" in r),
+        'skipped': skipped,
+        'write_groups': groups,
+        'session_id': data.get('session_id') or next((r["session_id"] for r in results if r.get("session_id")), None),
+        'execution_time': time.time() - tiempo_inicio
+    })
+
 # ==========================
 # ENDPOINTS DE ADMINISTRACIÓN
 # ==========================
@@ -687,12 +3992,19 @@ def list_backups():
     """Lista los respaldos de una tabla."""
     db = request.args.get('db')
     table = request.args.get('table')
-    backup_dir = os.path.join(DATA_DIR, db, "backups")
-    if not os.path.exists(backup_dir):
-        return jsonify({'backups': []})
-    files = [f for f in os.listdir(backup_dir) if f.startswith(table)]
+    files = [e["file"] for e in get_backup_index(db, table)]
     return jsonify({'backups': files})
 
+@app.route('/backups/status', methods=['GET'])
+def get_backup_status():
+    """Estado de la cola de respaldos en segundo plano (para monitorear el atraso)."""
+    return jsonify(backup_status())
+
+@app.route('/cache/status', methods=['GET'])
+def get_cache_status():
+    """Estadísticas de las cachés de resultados y de planes (entradas, aciertos y desalojos)."""
+    return jsonify({'results': result_cache_stats(), 'plans': plan_cache_stats()})
+
 @app.route('/restore_backup', methods=['POST'])
 def restore_backup():
     """Restaura un respaldo de una tabla."""
@@ -703,41 +4015,55 @@ def restore_backup():
     backup_path = os.path.join(DATA_DIR, db, "backups", backup_file)
     if not os.path.exists(backup_path):
         return jsonify({'error': 'Backup no encontrado'}), 404
-    with open(backup_path, "r") as f:
-        backup_data = json.load(f)
-    save_table(db, table, backup_data)
+    commit_mutation(db, table, {"op": "restore", "backup_file": backup_file})
     return jsonify({'message': f'Respaldo restaurado para {table} en {db}'})
 
 @app.route('/databases', methods=['GET'])
 def list_databases():
     """Lista todas las bases de datos."""
-    dbs = [d for d in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR, d))]
-    return jsonify({'databases': dbs})
+    return jsonify({'databases': catalog_list_databases()})
 
 @app.route('/drop_database', methods=['POST'])
 def drop_database():
     """Elimina una base de datos y todas sus tablas."""
     data = request.json
     db = data.get('db')
-    db_path = os.path.join(DATA_DIR, db)
     if not db or not is_valid_name(db):
         return jsonify({'error': 'Nombre de base de datos inválido'}), 400
-    if not os.path.exists(db_path):
-        return jsonify({'error': f'La base de datos {db} no existe'}), 400
-    shutil.rmtree(db_path)
-    query_cache.clear()
+    try:
+        drop_database_files(db)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     return jsonify({'message': f'Base de datos {db} eliminada'})
 
+@app.route('/schema', methods=['GET'])
+def get_schema():
+    """Todas las bases con sus tablas, columnas y conteo de filas en una sola respuesta."""
+    # Si el cliente ya tiene esta versión del catálogo se responde 304 sin tocar disco.
+    # El ETag es débil: identifica la versión del catálogo, no los bytes, que
+    # cambian según la compresión negociada (la comparación de If-None-Match
+    # también es débil, así que sirve con o sin el prefijo W/)
+    tag = f'"{catalog_version()}"'
+    if tag in request.headers.get('If-None-Match', ''):
+        response = app.response_class(status=304)
+    else:
+        version, databases = catalog_snapshot()
+        response = jsonify({'databases': databases, 'version': version})
+        tag = f'"{version}"'
+        response.headers['Cache-Control'] = 'no-cache'
+    response.headers['ETag'] = f'W/{tag}'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/tables', methods=['GET'])
 def list_tables():
     """Lista todas las tablas de una base de datos."""
     db = request.args.get('db')
-    db_path = os.path.join(DATA_DIR, db)
     if not db or not is_valid_name(db):
         return jsonify({'error': 'Nombre de base de datos inválido'}), 400
-    if not os.path.exists(db_path):
+    tables = catalog_list_tables(db)
+    if tables is None:
         return jsonify({'error': f'La base de datos {db} no existe'}), 400
-    tables = [f[:-5] for f in os.listdir(db_path) if f.endswith('.json') and f != "backups"]
     return jsonify({'tables': tables})
 
 @app.route('/columns', methods=['GET'])
@@ -746,10 +4072,10 @@ def get_columns():
     table = request.args.get('table')
     if not db or not table:
         return jsonify({'error': 'Faltan parámetros'}), 400
-    table_data = load_table(db, table)
-    if not table_data or "columns" not in table_data:
+    entry = catalog_table(db, table)
+    if not entry:
         return jsonify({'error': 'Tabla no encontrada'}), 404
-    return jsonify({'columns': table_data["columns"]})
+    return jsonify({'columns': entry["columns"]})
 
 # ==========================
 # ENDPOINT DE REGISTRO DE USUARIO
@@ -790,27 +4116,30 @@ def upload_csv():
     db_path = os.path.join(DATA_DIR, db)
     if not os.path.exists(db_path):
         os.makedirs(db_path)  # Crea la base si no existe
+        catalog_add_database(db)
 
-    table_path = os.path.join(db_path, f"{table}.json")
-    if os.path.exists(table_path):
-        table_data = load_table(db, table)
+    create_columns = None
+    if table_exists(db, table):
+        # Tabla existente: las filas van al log de inserciones, sin reescribirla
+        columns = load_table_schema(db, table)["columns"]
     else:
         # Si la tabla no existe, crea una nueva con columnas del CSV (tipo VARCHAR por defecto)
         reader = csv.DictReader(StringIO(file.read().decode('utf-8')))
-        columns = reader.fieldnames
-        table_data = {
-            "columns": [{"name": col, "type": "VARCHAR(255)"} for col in columns],
-            "rows": []
-        }
+        columns = create_columns = [{"name": col, "type": "VARCHAR(255)"} for col in reader.fieldnames]
         file.seek(0)  # Regresa el puntero para volver a leer
 
     reader = csv.DictReader(StringIO(file.read().decode('utf-8')))
-    count = 0
-    for row in reader:
-        filtered_row = {col["name"]: row[col["name"]] for col in table_data["columns"] if col["name"] in row}
-        table_data["rows"].append(filtered_row)
-        count += 1
-    save_table(db, table, table_data)
+    new_rows = []
+    try:
+        for line, row in enumerate(reader, start=2):
+            filtered_row = {col["name"]: row[col["name"]] for col in columns if col["name"] in row}
+            new_rows.append(coerce_row(columns, filtered_row))
+    except ValueError as e:
+        return jsonify({'error': f'Línea {line} del CSV: {e}'}), 400
+    try:
+        count = commit_mutation(db, table, {"op": "insert", "rows": new_rows}, create_columns=create_columns)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     return jsonify({'message': f'{count} filas agregadas a {table} en {db} desde CSV'})
 
 
@@ -823,4 +4152,7 @@ def health():
 # INICIO DE LA APP
 # ==========================
 if __name__ == '__main__':
+    migrate_all_tables()
+    wal_recover()
+    migrate_typed_tables()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
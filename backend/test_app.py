@@ -0,0 +1,86 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # DATA_DIR es relativo: el servidor trabaja sobre una carpeta temporal vacía.
+    # Se fija como ruta absoluta para que los hilos de fondo y atexit no
+    # escriban en el directorio desde el que se corren las pruebas
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("fulldb"))
+    try:
+        import app
+        app.DATA_DIR = os.path.abspath(app.DATA_DIR)
+    finally:
+        os.chdir(cwd)
+    return app.app.test_client()
+
+
+def run(client, query, **kw):
+    response = client.post("/execute", json={"query": query, **kw})
+    return response.status_code, response.get_json()
+
+
+def rows(client, query):
+    status, result = run(client, query)
+    assert status == 200, result
+    return result["rows"]
+
+
+def test_select_and_delete_agree_on_numeric_text(client):
+    # Una columna VARCHAR con números: WHERE los compara como números en
+    # SELECT y en DELETE
+    run(client, "CREATE DATABASE dml")
+    run(client, "CREATE TABLE dml.codes (id INT PRIMARY KEY, code VARCHAR(5))")
+    for i, code in enumerate(["8", "9", "10", "abc"]):
+        run(client, f"INSERT INTO dml.codes (id, code) VALUES ({i}, '{code}')")
+    selected = {r["id"] for r in rows(client, "SELECT id FROM dml.codes WHERE code > 9")}
+    assert 2 in selected and 0 not in selected
+    status, result = run(client, "DELETE FROM dml.codes WHERE code > 9")
+    assert status == 200 and result["rows_affected"] == len(selected)
+    remaining = {r["id"] for r in rows(client, "SELECT id FROM dml.codes")}
+    assert remaining == {0, 1, 2, 3} - selected
+
+
+def test_update_matches_like_select(client):
+    run(client, "CREATE DATABASE upd")
+    run(client, "CREATE TABLE upd.codes (id INT PRIMARY KEY, code VARCHAR(5), flag INT)")
+    run(client, "INSERT INTO upd.codes (id, code, flag) VALUES (1, '1.0', 0)")
+    assert len(rows(client, "SELECT id FROM upd.codes WHERE code = 1")) == 1
+    status, result = run(client, "UPDATE upd.codes SET flag = 1 WHERE code = 1")
+    assert status == 200 and result["rows_affected"] == 1
+
+
+
+def test_index_in_list_with_repeated_values(client):
+    run(client, "CREATE DATABASE idx")
+    run(client, "CREATE TABLE idx.a (id INT PRIMARY KEY, k INT, j INT)")
+    for i in range(6):
+        run(client, f"INSERT INTO idx.a (id, k, j) VALUES ({i}, {i % 3}, {i % 2})")
+    queries = ["SELECT id FROM idx.a WHERE k IN (1, 1.0)",
+               "SELECT COUNT(*) AS n FROM idx.a WHERE k IN (1, 1)",
+               "SELECT id FROM idx.a WHERE k IN (2, 1, 2) AND j IN (0, 0, 1)"]
+    expected = [rows(client, query) for query in queries]
+    run(client, "CREATE INDEX ik ON idx.a (k, j)")
+    assert [rows(client, query) for query in queries] == expected
+
+
+def test_plan_cache_does_not_merge_comment_text(client):
+    # Sin el salto de línea el WHERE queda dentro del comentario
+    run(client, "CREATE DATABASE pc")
+    run(client, "CREATE TABLE pc.a (id INT PRIMARY KEY, k INT)")
+    run(client, "INSERT INTO pc.a (id, k) VALUES (1, 1)")
+    run(client, "INSERT INTO pc.a (id, k) VALUES (2, 2)")
+    assert len(rows(client, "SELECT * FROM pc.a -- nota\nWHERE k = 1")) == 1
+    assert len(rows(client, "SELECT * FROM pc.a -- nota WHERE k = 1")) == 2
+    assert len(rows(client, "SELECT * FROM pc.a WHERE k = 1 -- nota")) == 1
+    assert len(rows(client, "SELECT * FROM pc.a /* nota */ WHERE k = 1")) == 1
+    # Espacios y comentarios distintos siguen compartiendo el plan
+    hits = client.get("/cache/status").get_json()["plans"]["hits"]
+    assert len(rows(client, "SELECT  *  FROM pc.a\n-- otra nota\nWHERE k = 1;")) == 1
+    assert client.get("/cache/status").get_json()["plans"]["hits"] == hits + 1
@@ -1,7 +1,7 @@
-import React, { useState, useEffect, useRef } from "react";
+import React, { useState, useEffect, useRef, useMemo } from "react";
 import "./App.css";
 import { EditorView } from "@codemirror/view";
-import { EditorState } from "@codemirror/state";
+import { EditorState, Compartment } from "@codemirror/state";
 import { sql } from "@codemirror/lang-sql";
 import { autocompletion } from "@codemirror/autocomplete";
 import { syntaxHighlighting } from "@codemirror/language";
@@ -49,9 +49,11 @@ const myTheme = createTheme({
 });
 
 
-function SqlEditor({ query, setQuery }) {
+function SqlEditor({ query, setQuery, schema }) {
   const editorRef = useRef(null);
   const viewRef = useRef(null);
+  // El dialecto SQL se reconfigura cuando llega un esquema nuevo (autocompletado)
+  const sqlConfig = useRef(new Compartment());
 
   useEffect(() => {
     if (!editorRef.current) return;
@@ -60,7 +62,8 @@ function SqlEditor({ query, setQuery }) {
       state: EditorState.create({
         doc: query,
         extensions: [
-          sql(),
+          sqlConfig.current.of(sql({ schema })),
+          autocompletion(),
           keymap.of(defaultKeymap),
           myTheme,
           syntaxHighlighting(defaultHighlightStyle),
@@ -81,6 +84,11 @@ function SqlEditor({ query, setQuery }) {
     return () => view.destroy();
   }, []);
 
+  useEffect(() => {
+    if (!viewRef.current) return;
+    viewRef.current.dispatch({ effects: sqlConfig.current.reconfigure(sql({ schema })) });
+  }, [schema]);
+
   return <div ref={editorRef} className="sql-editor-container" />;
 }
 
@@ -92,6 +100,8 @@ function App() {
   const [history, setHistory] = useState([]);
   const [leftWidth, setLeftWidth] = useState(50);
   const [isDragging, setIsDragging] = useState(false);
+  // Id de sesión para que BEGIN/COMMIT/ROLLBACK agrupen varias consultas
+  const sessionIdRef = useRef(Math.random().toString(36).slice(2) + Date.now().toString(36));
   // Nuevo estado para bases de datos y tablas
   const [databases, setDatabases] = useState([]);
   const [expandedDb, setExpandedDb] = useState(null);          // Base de datos expandida
@@ -133,9 +143,20 @@ function App() {
   const [showUserPanel, setShowUserPanel] = useState(false);
   // Estado para animación de fade del panel de usuario
   const [userPanelFade, setUserPanelFade] = useState(false);
-  // Para cargar columnas de una tabla
-  const [selectedTableColumns, setSelectedTableColumns] = useState([]);
+  // Columnas de cada tabla ("db.tabla"), vienen en el mismo esquema que las bases
+  const [columnsByTable, setColumnsByTable] = useState({});
   const [selectedTable, setSelectedTable] = useState(null);
+  const selectedTableColumns = (selectedTable && columnsByTable[`${selectedDb}.${selectedTable}`]) || [];
+  // Esquema para el autocompletado del editor: { "db.tabla": [columnas] }
+  const editorSchema = useMemo(() => {
+    const schema = {};
+    Object.entries(columnsByTable).forEach(([key, cols]) => {
+      schema[key] = cols.map(col => col.name);
+    });
+    return schema;
+  }, [columnsByTable]);
+  // ETag del último esquema recibido
+  const schemaEtagRef = useRef(null);
   const [mainContentAnim, setMainContentAnim] = useState("");
   const [user, setUser] = useState(null);
   // Estado global para tooltip de columna
@@ -208,20 +229,36 @@ function App() {
     }
 
 
-// Función para cargar columnas de una tabla
-const handleShowColumns = (db, table) => {
-  fetch(`http://127.0.0.1:5000/columns?db=${db}&table=${table}`)
-    .then(res => res.json())
-    .then(data => {
-      setSelectedTableColumns(data.columns || []);
-      setSelectedTable(table);
-      setSelectedDb(db);
-    })
-    .catch(() => {
-      setSelectedTableColumns([]);
-      setSelectedTable(table);
-      setSelectedDb(db);
+// Carga bases, tablas y columnas con una sola petición a /schema.
+// Si el esquema no cambió desde la última vez el backend responde 304 y no se toca nada.
+const loadSchema = async () => {
+  try {
+    const headers = schemaEtagRef.current ? { 'If-None-Match': schemaEtagRef.current } : {};
+    const res = await fetch('http://127.0.0.1:5000/schema', { headers });
+    if (res.status === 304 || !res.ok) return;
+    const data = await res.json();
+    schemaEtagRef.current = res.headers.get('ETag');
+    const tables = {};
+    const columns = {};
+    (data.databases || []).forEach(db => {
+      tables[db.name] = db.tables.map(t => t.name);
+      db.tables.forEach(t => { columns[`${db.name}.${t.name}`] = t.columns; });
     });
+    setDatabases((data.databases || []).map(db => db.name));
+    setTablesByDb(tables);
+    setColumnsByTable(columns);
+  } catch (err) {
+    schemaEtagRef.current = null;
+    setDatabases([]);
+    setTablesByDb({});
+    setColumnsByTable({});
+  }
+};
+
+// Función para mostrar las columnas de una tabla (ya están en el esquema)
+const handleShowColumns = (db, table) => {
+  setSelectedTable(table);
+  setSelectedDb(db);
 };
 
   // Efecto para aplicar el tema claro/oscuro
@@ -236,29 +273,19 @@ const handleShowColumns = (db, table) => {
     localStorage.setItem("lightTheme", lightTheme);
   }, [lightTheme]);
 
-  // Obtener bases de datos al montar
+  // Obtener el esquema completo al montar
   useEffect(() => {
-    fetch('http://127.0.0.1:5000/databases')
-      .then(res => res.json())
-      .then(data => setDatabases(data.databases || []))
-      .catch(() => setDatabases([]));
+    loadSchema();
   }, []);
 
   useEffect(() => {
   if (!expandedDb || tablesByDb[expandedDb]) return;
 
+  // La base no venía en el último esquema: se vuelve a pedir
   setLoadingTables(prev => ({ ...prev, [expandedDb]: true }));
-
-  fetch(`http://127.0.0.1:5000/tables?db=${expandedDb}`)
-    .then(res => res.json())
-    .then(data => {
-      setTablesByDb(prev => ({ ...prev, [expandedDb]: data.tables || [] }));
-      setLoadingTables(prev => ({ ...prev, [expandedDb]: false }));
-    })
-    .catch(() => {
-      setTablesByDb(prev => ({ ...prev, [expandedDb]: [] }));
-      setLoadingTables(prev => ({ ...prev, [expandedDb]: false }));
-    });
+  loadSchema().finally(() => {
+    setLoadingTables(prev => ({ ...prev, [expandedDb]: false }));
+  });
 }, [expandedDb, tablesByDb]);
 
 
@@ -293,18 +320,8 @@ const handleShowColumns = (db, table) => {
 
 // Función para refrescar la lista de bases de datos y tablas
 const refreshDatabases = async (dbToRefresh = null) => {
-  // Actualiza bases de datos
-  fetch('http://127.0.0.1:5000/databases')
-    .then(res => res.json())
-    .then(data => setDatabases(data.databases || []))
-    .catch(() => setDatabases([]));
-  // Si se pasa una base, refresca sus tablas
-  if (dbToRefresh) {
-    fetch(`http://127.0.0.1:5000/tables?db=${dbToRefresh}`)
-      .then(res => res.json())
-      .then(data => setTablesByDb(prev => ({ ...prev, [dbToRefresh]: data.tables || [] })))
-      .catch(() => setTablesByDb(prev => ({ ...prev, [dbToRefresh]: [] })));
-  }
+  // El esquema trae todas las bases, incluida dbToRefresh
+  await loadSchema();
 };
 
   const handleExtract = async () => {
@@ -328,7 +345,7 @@ const refreshDatabases = async (dbToRefresh = null) => {
           headers: {
             'Content-Type': 'application/json'
           },
-          body: JSON.stringify({ query: q })
+          body: JSON.stringify({ query: q, session_id: sessionIdRef.current })
         });
         const data = await response.json();
         if (!response.ok) {
@@ -768,37 +785,13 @@ useEffect(() => {
                 }}
                 title="Refrescar bases de datos"
                 onClick={() => {
-                fetch('http://127.0.0.1:5000/databases')
-                  .then(res => res.json())
-                  .then(data => setDatabases(data.databases || []))
-                  .catch(() => setDatabases([]));
-                fetch(`http://127.0.0.1:5000/tables?db=${expandedDb}`)
-                  .then(res => res.json())
-                  .then(data => {
-                    setTablesByDb(prev => ({ ...prev, [expandedDb]: data.tables || [] }));
-                    setLoadingTables(prev => ({ ...prev, [expandedDb]: false }));
-                  })
-                  .catch(() => {
-                    setTablesByDb(prev => ({ ...prev, [expandedDb]: [] }));
-                    setLoadingTables(prev => ({ ...prev, [expandedDb]: false }));
-                  });
-                  // Si hay una tabla seleccionada, refresca sus columnas
-                    if (selectedDb && selectedTable) {
-                      fetch(`http://127.0.0.1:5000/columns?db=${selectedDb}&table=${selectedTable}`)
-                        .then(res => res.json())
-                        .then(data => {
-                          setSelectedTableColumns(data.columns || []);
-                        })
-                        .catch(() => {
-                          setSelectedTableColumns([]);
-                        });
-                    } else {
-                      // Si no hay tabla seleccionada, limpia columnas
-                      setSelectedTableColumns([]);
-                      setSelectedTable(null);
-                      setSelectedDb(null);
-                    }
-                  }}
+                  loadSchema();
+                  // Si no hay tabla seleccionada, limpia la selección
+                  if (!selectedDb || !selectedTable) {
+                    setSelectedTable(null);
+                    setSelectedDb(null);
+                  }
+                }}
               onMouseOver={e => e.currentTarget.style.background = "#23263a"}
               onMouseOut={e => e.currentTarget.style.background = "none"}
             >
@@ -931,7 +924,7 @@ useEffect(() => {
         <div className="main-content">
           <div className="left-panel" style={{ width: `${leftWidth}%` }}>
             <div className="query-input">
-              <SqlEditor query={query} setQuery={setQuery} />
+              <SqlEditor query={query} setQuery={setQuery} schema={editorSchema} />
               <div className="buttons-row">
                 <button onClick={handleExtract} style={{ display: 'flex', alignItems: 'center', gap: '4px', cursor: 'pointer' }}>
                   <svg xmlns="http://www.w3.org/2000/svg" width="18" height="18" fill="none" viewBox="0 0 24 24" stroke="currentColor"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M5 3v18l15-9-15-9z" /></svg>